@@ -14,18 +14,19 @@ class Announcer:
     def __init__(self, federated_topic) -> None:
         self.federated_topic = federated_topic
 
-    def announce(self, ctx) -> None:
+    async def announce(self, ctx, seqn: int = 0) -> None:
         from federator import Context
         ctx: Context = ctx
         ann = CoreAnn(
             core_id=ctx.id,
             dist=0,
-            sender_id=ctx.id
+            sender_id=ctx.id,
+            seqn=seqn
         )
 
         topic, payload = ann.serialize(fed_topic=self.federated_topic)
 
-        for id, neighbor in ctx.neighbors.items():
-            neighbor.publish(topic, payload, NEIGHBORS_QOS)
+        for id in ctx.neighbors:
+            await ctx.send_control(id, topic, payload)
 
         logger.info(f"WORKER[{self.federated_topic}]: Started announcing as {self.federated_topic} Core...")
\ No newline at end of file
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import struct
+from typing import Iterator, Tuple
+from typing import Dict
+from topics import BATCH_TOPIC_LEVEL, CONTROL_BATCH_TOPIC_LEVEL
+from message import classify, CORE_ANN, MEMB_ANN, PRUNE, ROUTED_PUB
+
+NEIGHBORS_QOS = 2
+
+# Batch payload: version byte, then per entry topic length, payload length,
+# topic and payload. Entries are whole MQTT messages a neighbor would
+# otherwise have received one by one.
+BATCH_VERSION = 1
+ENTRY = struct.Struct("!HI")
+BATCHABLE = frozenset((CORE_ANN, MEMB_ANN, PRUNE, ROUTED_PUB))
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def unbatch(payload: bytes) -> Iterator[Tuple[str, memoryview]]:
+    """Yields the (topic, payload) entries of a batch, payloads are views into it."""
+    view = memoryview(payload)
+    if not view or view[0] != BATCH_VERSION:
+        raise ValueError("Unknown batch format")
+
+    offset = 1
+    while offset < len(view):
+        topic_len, payload_len = ENTRY.unpack_from(view, offset)
+        offset += ENTRY.size
+        topic = str(view[offset:offset + topic_len], 'utf-8')
+        offset += topic_len
+        if offset + payload_len > len(view):
+            raise ValueError("Truncated batch entry")
+        yield topic, view[offset:offset + payload_len]
+        offset += payload_len
+
+
+def classify_entries(payload: bytes) -> Iterator[Tuple[int, str, memoryview]]:
+    """Yields kind, federated topic and payload of each entry of a batch."""
+    for topic, entry in unbatch(payload):
+        kind, federated_topic = classify(topic, entry)
+        if kind not in BATCHABLE:
+            raise ValueError(f"Message kind {kind} cannot be batched ({topic})")
+        yield kind, federated_topic, entry
+
+
+class LinkBatcher:
+    """Coalesces the RoutedPubs sent to one neighbor into framed MQTT messages.
+
+    Pending entries go out when they reach max_bytes or when the first of them
+    has waited linger seconds. A lone entry is published as it is, so a quiet
+    link pays no framing overhead.
+    """
+    def __init__(self, id: int, channel, sender_id: int, linger: float, max_bytes: int) -> None:
+        from channel import OutboundChannel
+        self.id = id
+        self.channel: OutboundChannel = channel
+        self.topic = f"{BATCH_TOPIC_LEVEL}{sender_id}"
+        self.linger = linger
+        self.max_bytes = max_bytes
+        self.entries = []
+        self.parts = [bytes((BATCH_VERSION,))]
+        self.size = 1
+        self.timer = None
+
+    async def add(self, topic: str, payload) -> None:
+        encoded_topic = topic.encode('utf-8')
+        self.entries.append((topic, payload))
+        self.parts.append(ENTRY.pack(len(encoded_topic), len(payload)))
+        self.parts.append(encoded_topic)
+        self.parts.append(payload)
+        self.size += ENTRY.size + len(encoded_topic) + len(payload)
+
+        if self.size >= self.max_bytes:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.linger, self.expire)
+
+    def expire(self) -> None:
+        self.timer = None
+        asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        # Take the pending entries first, publishing may wait for the channel
+        entries, parts = self.entries, self.parts
+        self.entries = []
+        self.parts = parts[:1]
+        self.size = 1
+
+        if len(entries) == 1:
+            topic, payload = entries[0]
+            await self.channel.publish(topic, payload, NEIGHBORS_QOS)
+        elif entries:
+            logger.debug(f"Sending batch of {len(entries)} messages to neighbor {self.id}")
+            await self.channel.publish(self.topic, b"".join(parts), NEIGHBORS_QOS)
+
+
+class ControlBatcher:
+    """Collects the announcements for one neighbor and sends them on a tick.
+
+    Pending announcements are kept by MQTT topic: a newer one for the same
+    topic replaces the older one and moves to the end, so the neighbor ends
+    in the same state as if it had received them all in order. They leave as
+    one framed message on the control batch topic every linger seconds, or
+    sooner when max_bytes are pending.
+    """
+    def __init__(self, id: int, channel, sender_id: int, linger: float, max_bytes: int) -> None:
+        from channel import OutboundChannel
+        self.id = id
+        self.channel: OutboundChannel = channel
+        self.topic = f"{CONTROL_BATCH_TOPIC_LEVEL}{sender_id}"
+        self.linger = linger
+        self.max_bytes = max_bytes
+        self.pending: Dict[str, bytes] = {}
+        self.size = 1
+        self.timer = None
+        self.coalesced = 0
+
+    async def add(self, topic: str, payload) -> None:
+        previous = self.pending.pop(topic, None)
+        if previous is not None:
+            self.size -= ENTRY.size + len(topic.encode('utf-8')) + len(previous)
+            self.coalesced += 1
+        self.pending[topic] = payload
+        self.size += ENTRY.size + len(topic.encode('utf-8')) + len(payload)
+
+        if self.size >= self.max_bytes:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.linger, self.expire)
+
+    def expire(self) -> None:
+        self.timer = None
+        asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        pending = self.pending
+        self.pending = {}
+        self.size = 1
+
+        if len(pending) == 1:
+            topic, payload = next(iter(pending.items()))
+            await self.channel.publish(topic, payload, NEIGHBORS_QOS, control=True)
+        elif pending:
+            parts = [bytes((BATCH_VERSION,))]
+            for topic, payload in pending.items():
+                encoded_topic = topic.encode('utf-8')
+                parts.append(ENTRY.pack(len(encoded_topic), len(payload)))
+                parts.append(encoded_topic)
+                parts.append(payload)
+            logger.debug(f"Sending {len(pending)} announcements to neighbor {self.id}")
+            await self.channel.publish(self.topic, b"".join(parts), NEIGHBORS_QOS, control=True)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Callable, Iterator, Optional, Tuple
+
+# File: magic, then one record per inbound message. Record: receive time in
+# ns since the epoch, id of the broker the message was received from, QoS,
+# topic length, payload length, then the topic and the payload.
+MAGIC = b"FEDCAP01"
+RECORD = struct.Struct("!QIBHI")
+
+# Written out at least this often, a crash loses at most that much
+FLUSH_INTERVAL = 1.0
+BUFFER_SIZE = 1024 * 1024
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Capture:
+    """Appends every message received by a host client to a capture file.
+
+    record() runs on the paho network thread with the threaded transport: the
+    buffered file serializes the writes, each record being a single write.
+    """
+    def __init__(self, file, source: int) -> None:
+        self.file = file
+        self.source = source
+        self.records = 0
+
+    def tap(self, on_message: Callable) -> Callable:
+        """on_message callback recording the message before handing it to on_message."""
+        def capture_message(client, userdata, msg) -> None:
+            self.record(msg)
+            on_message(client, userdata, msg)
+        return capture_message
+
+    def record(self, msg) -> None:
+        topic = msg.topic.encode('utf-8')
+        payload = msg.payload
+        try:
+            self.file.write(b"".join((RECORD.pack(time.time_ns(), self.source, msg.qos, len(topic), len(payload)), topic, payload)))
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot capture message on {msg.topic}: {e}")
+            return
+        self.records += 1
+
+    def flush(self) -> None:
+        try:
+            self.file.flush()
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot flush capture: {e}")
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+        logger.info(f"Captured {self.records} messages")
+
+
+def open_capture(path: str, source: int) -> Optional[Capture]:
+    """Capture appending to path, None if it is not a capture file or cannot be opened."""
+    try:
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            if not repair(path):
+                logger.error(f"Not capturing to {path}: not a capture file")
+                return None
+            file = open(path, 'ab', buffering=BUFFER_SIZE)
+        else:
+            file = open(path, 'wb', buffering=BUFFER_SIZE)
+            file.write(MAGIC)
+    except OSError as e:
+        logger.error(f"Cannot capture to {path}: {e}")
+        return None
+
+    logger.info(f"Capturing inbound messages to {path}")
+    return Capture(file, source)
+
+
+def complete_size(data) -> int:
+    """Size of the records of a capture up to the first one cut short."""
+    offset = len(MAGIC)
+    size = len(data)
+    while offset + RECORD.size <= size:
+        _, _, _, topic_len, payload_len = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + topic_len + payload_len
+        if end > size:
+            break
+        offset = end
+    return offset
+
+
+def repair(path: str) -> bool:
+    """Drops a record cut short by a crash from the end of a capture, False if path is not a capture."""
+    with open(path, 'r+b') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            return False
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = complete_size(data)
+        if size < os.fstat(file.fileno()).st_size:
+            logger.warning(f"Dropping a truncated record from the end of {path}")
+            file.truncate(size)
+    return True
+
+
+async def flush_capture(capture: Capture, interval: float = FLUSH_INTERVAL) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        capture.flush()
+
+
+def read(path: str) -> Iterator[Tuple[int, int, int, str, bytes]]:
+    """Yields the (time_ns, source, qos, topic, payload) records of a capture file.
+
+    The file is memory-mapped and read sequentially, only the record being
+    yielded is copied, so captures larger than memory can be read. A record
+    cut short by a crash ends the capture.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size <= len(MAGIC):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a capture file")
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                data.madvise(mmap.MADV_SEQUENTIAL)
+
+            offset = len(MAGIC)
+            size = len(data)
+            while offset + RECORD.size <= size:
+                time_ns, source, qos, topic_len, payload_len = RECORD.unpack_from(data, offset)
+                start = offset + RECORD.size
+                end = start + topic_len + payload_len
+                if end > size:
+                    break
+                yield time_ns, source, qos, str(data[start:start + topic_len], 'utf-8'), data[start + topic_len:end]
+                offset = end
+
+            if offset < size:
+                logger.warning(f"Capture {path} ends with a truncated record")
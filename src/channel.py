@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Dict
+import paho.mqtt.client as mqtt
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+LINK_REPORT_INTERVAL = 10
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class OutboundChannel:
+    """Bounded outbound path to one neighbor broker.
+
+    At most max_inflight QoS>0 publishes are handed to paho before their
+    acknowledgement comes back; the rest wait here within a byte budget.
+    When the budget is exhausted data messages block the publishing worker
+    or are dropped according to the overflow policy. Control messages
+    (announcements) are small and never dropped: they bypass the budget and
+    go out before queued data.
+    """
+    def __init__(self, id: int, client: mqtt.Client, loop: asyncio.AbstractEventLoop, max_inflight: int, max_bytes: int, overflow: str) -> None:
+        self.id = id
+        self.client = client
+        self.loop = loop
+        self.max_inflight = max_inflight
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+
+        self.control = deque()
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.inflight = set()
+        self.space = asyncio.Event()
+        self.space.set()
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+        client.max_inflight_messages_set(max_inflight)
+        client.on_publish = self.on_publish
+
+    # Callback for when a publish is acknowledged (paho thread or loop)
+    def on_publish(self, client, userdata, mid) -> None:
+        self.loop.call_soon_threadsafe(self.acked, mid)
+
+    def acked(self, mid: int) -> None:
+        self.inflight.discard(mid)
+        self.drain()
+
+    def depth(self) -> int:
+        return len(self.control) + len(self.queue)
+
+    async def publish(self, topic: str, payload, qos: int, control: bool = False) -> None:
+        if control:
+            self.control.append((topic, payload, qos))
+            self.drain()
+            return
+
+        size = len(payload)
+        while self.queue and self.queued_bytes + size > self.max_bytes:
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self.overflow == OVERFLOW_DROP_OLDEST:
+                _, old_payload, _ = self.queue.popleft()
+                self.queued_bytes -= len(old_payload)
+                self.dropped += 1
+            else:
+                self.space.clear()
+                await self.space.wait()
+
+        self.queue.append((topic, payload, qos))
+        self.queued_bytes += size
+        self.drain()
+
+    def drain(self) -> None:
+        while len(self.inflight) < self.max_inflight:
+            if self.control:
+                topic, payload, qos = self.control.popleft()
+            elif self.queue:
+                topic, payload, qos = self.queue.popleft()
+                self.queued_bytes -= len(payload)
+            else:
+                break
+            self.send(topic, payload, qos)
+
+        if self.queued_bytes < self.max_bytes:
+            self.space.set()
+
+    def send(self, topic: str, payload, qos: int) -> None:
+        info = self.client.publish(topic, payload, qos)
+        if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            self.failed += 1
+            logger.error(f"Neighbor {self.id} refused a publish on {topic}")
+            return
+
+        # NO_CONN is fine: paho keeps QoS>0 messages until it reconnects
+        self.sent += 1
+        if qos > 0:
+            self.inflight.add(info.mid)
+
+
+def create_channels(neighbors_clients: Dict[int, mqtt.Client], loop: asyncio.AbstractEventLoop, max_inflight: int, max_bytes: int, overflow: str) -> Dict[int, OutboundChannel]:
+    return {
+        id: OutboundChannel(id, client, loop, max_inflight, max_bytes, overflow)
+        for id, client in neighbors_clients.items()
+    }
+
+
+async def report_links(channels: Dict[int, OutboundChannel]) -> None:
+    """Periodically logs the links that are backed up or dropping messages."""
+    last_dropped = {id: 0 for id in channels}
+    while True:
+        await asyncio.sleep(LINK_REPORT_INTERVAL)
+        for id, channel in channels.items():
+            dropped = channel.dropped - last_dropped[id]
+            last_dropped[id] = channel.dropped
+            if channel.depth() or dropped:
+                logger.info(f"Neighbor {id}: queued={channel.depth()} bytes={channel.queued_bytes} "
+                            f"inflight={len(channel.inflight)} dropped={dropped} failed={channel.failed}")
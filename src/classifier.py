@@ -0,0 +1,90 @@
+from typing import Dict, Tuple
+
+# Path entry layout: [kind of the prefix ending here or None, whether longer management topics start with it]
+KIND = 0
+DEEPER = 1
+
+
+class TopicClassifier:
+    """Hash table of the management topic paths, built once.
+
+    Exact topics (the broker logs) and two-level prefixes ("federator/x/")
+    with nothing registered below them are each found with one lookup, which
+    covers the management topics the federator uses. Otherwise match() looks
+    up the topic one level at a time ("a/", then "a/b/"...) and stops as soon
+    as no longer management topic starts with what it has seen. Publications,
+    whose first level starts no management topic, cost three lookups however
+    many prefixes are registered.
+    """
+    def __init__(self, default_kind: int) -> None:
+        self.default_kind = default_kind
+        # Every level path ("a/", "a/b/") of the registered topics and prefixes
+        self.paths: Dict[str, list] = {}
+        self.topics: Dict[str, int] = {}
+        # Kinds of the two-level prefixes no longer management topic starts with
+        self.shortcuts: Dict[str, int] = {}
+
+    def path(self, levels) -> list:
+        """Entry of the path made of levels, its parents marked as leading to it."""
+        path = ""
+        entry = None
+        for level in levels:
+            if entry is not None:
+                entry[DEEPER] = True
+            path += level + '/'
+            entry = self.paths.setdefault(path, [None, False])
+        return entry
+
+    def update_shortcuts(self) -> None:
+        self.shortcuts = {
+            path: entry[KIND] for path, entry in self.paths.items()
+            if path.count('/') == 2 and entry[KIND] is not None and not entry[DEEPER]
+        }
+
+    def add_prefix(self, prefix: str, kind: int) -> None:
+        """Topics under prefix ("a/b/") are of this kind, the rest is the federated topic."""
+        assert prefix.endswith('/'), "Prefix must end with a topic level separator"
+        self.path(prefix[:-1].split('/'))[KIND] = kind
+        self.update_shortcuts()
+
+    def add_topic(self, topic: str, kind: int) -> None:
+        """Exactly this topic is of this kind."""
+        self.topics[topic] = kind
+        levels = topic.split('/')[:-1]
+        if levels:
+            self.path(levels)[DEEPER] = True
+        self.update_shortcuts()
+
+    def match(self, topic: str) -> Tuple[int, int]:
+        """Returns the kind of topic and the offset where its federated topic starts."""
+        kind = self.topics.get(topic)
+        if kind is not None:
+            return kind, len(topic)
+
+        first = topic.find('/') + 1
+        second = topic.find('/', first) + 1
+        kind = self.shortcuts.get(topic[:second])
+        if kind is not None:
+            return kind, second
+        if topic[:first] not in self.paths:
+            return self.default_kind, 0
+        return self.walk(topic)
+
+    def walk(self, topic: str) -> Tuple[int, int]:
+        """match() one level at a time, for the prefixes without a shortcut."""
+        paths = self.paths
+        kind = self.default_kind
+        start = 0
+        end = 0
+        while True:
+            end = topic.find('/', end) + 1
+            if not end:
+                return kind, start
+            entry = paths.get(topic[:end])
+            if entry is None:
+                return kind, start
+            if entry[KIND] is not None:
+                kind = entry[KIND]
+                start = end
+            if not entry[DEEPER]:
+                return kind, start
@@ -1,6 +1,11 @@
 import toml
 from typing import List
 from dataclasses import dataclass
+from transport import TRANSPORTS, TRANSPORT_THREAD, TRANSPORT_LOOPBACK
+from message import WIRE_FORMATS, WIRE_PICKLE
+from interest import SUBSCRIPTION_MODES, SUBSCRIBE_ALL
+from channel import OVERFLOW_POLICIES, OVERFLOW_BLOCK
+from pool import ENGINES, ENGINE_TASKS
 
 @dataclass
 class BrokerConfig:
@@ -14,6 +19,40 @@ class FederatorConfig:
     cache_size: int
     host: BrokerConfig
     neighbors: List[BrokerConfig]
+    transport: str = TRANSPORT_THREAD
+    shards: int = 0
+    wire_format: str = WIRE_PICKLE
+    accept_pickle: bool = True
+    host_subscriptions: str = SUBSCRIBE_ALL
+    batch_linger_ms: float = 0
+    batch_max_bytes: int = 65536
+    neighbor_max_inflight: int = 100
+    neighbor_max_bytes: int = 16 * 1024 * 1024
+    neighbor_overflow: str = OVERFLOW_BLOCK
+    worker_idle_ttl: float = 0
+    engine: str = ENGINE_TASKS
+    pool_size: int = 64
+    dedup_budget: int = 0
+    control_priority: bool = True
+    control_linger_ms: float = 0
+    core_refresh_ms: float = 0
+    # 0: 3 x core_refresh_ms, see core_timeout()
+    core_timeout_ms: float = 0
+    snapshot_path: str = ""
+    snapshot_interval: float = 30
+    metrics_port: int = 0
+    metrics_top_k: int = 20
+    trace_sample: float = 0
+    capture_path: str = ""
+
+
+def core_timeout(config: FederatorConfig) -> float:
+    """Seconds after which a core, parent or child not heard of expires."""
+    timeout_ms = config.core_timeout_ms
+    if timeout_ms <= config.core_refresh_ms:
+        # Unset, or too short to hear of anyone between two refreshes
+        timeout_ms = 3 * config.core_refresh_ms
+    return timeout_ms / 1000
 
 
 # Read and parse the TOML file
@@ -39,12 +78,110 @@ def read_config_file(file_path):
         neighbor_data = config_data['neighbors']
         neighbors = [BrokerConfig(id=n['id'], ip=n['ip'], port=n['port']) for n in neighbor_data]
 
+        transport = config_data.get('transport', TRANSPORT_THREAD)
+        if transport not in TRANSPORTS:
+            print(f"Error: Unknown transport '{transport}', expected one of {TRANSPORTS}.")
+            return None
+
+        shards = config_data.get('shards', 0)
+        if shards < 0:
+            print(f"Error: 'shards' must be zero or positive, got {shards}.")
+            return None
+        if shards > 0 and transport == TRANSPORT_LOOPBACK:
+            print("Error: loopback brokers only exist within one process, 'shards' must be 0.")
+            return None
+
+        wire_format = config_data.get('wire_format', WIRE_PICKLE)
+        if wire_format not in WIRE_FORMATS:
+            print(f"Error: Unknown wire_format '{wire_format}', expected one of {WIRE_FORMATS}.")
+            return None
+        accept_pickle = config_data.get('accept_pickle', True)
+
+        host_subscriptions = config_data.get('host_subscriptions', SUBSCRIBE_ALL)
+        if host_subscriptions not in SUBSCRIPTION_MODES:
+            print(f"Error: Unknown host_subscriptions '{host_subscriptions}', expected one of {SUBSCRIPTION_MODES}.")
+            return None
+
+        batch_linger_ms = config_data.get('batch_linger_ms', 0)
+        batch_max_bytes = config_data.get('batch_max_bytes', 65536)
+
+        neighbor_max_inflight = config_data.get('neighbor_max_inflight', 100)
+        neighbor_max_bytes = config_data.get('neighbor_max_bytes', 16 * 1024 * 1024)
+        neighbor_overflow = config_data.get('neighbor_overflow', OVERFLOW_BLOCK)
+        if neighbor_overflow not in OVERFLOW_POLICIES:
+            print(f"Error: Unknown neighbor_overflow '{neighbor_overflow}', expected one of {OVERFLOW_POLICIES}.")
+            return None
+
+        worker_idle_ttl = config_data.get('worker_idle_ttl', 0)
+
+        engine = config_data.get('engine', ENGINE_TASKS)
+        if engine not in ENGINES:
+            print(f"Error: Unknown engine '{engine}', expected one of {ENGINES}.")
+            return None
+        pool_size = config_data.get('pool_size', 64)
+        if pool_size < 1:
+            print(f"Error: 'pool_size' must be positive, got {pool_size}.")
+            return None
+
+        dedup_budget = config_data.get('dedup_budget', 0)
+        control_priority = config_data.get('control_priority', True)
+        control_linger_ms = config_data.get('control_linger_ms', 0)
+
+        core_refresh_ms = config_data.get('core_refresh_ms', 0)
+        core_timeout_ms = config_data.get('core_timeout_ms', 0)
+        if core_refresh_ms > 0 and 0 < core_timeout_ms <= core_refresh_ms:
+            print(f"Error: 'core_timeout_ms' must be longer than 'core_refresh_ms', got {core_timeout_ms}.")
+            return None
+
+        snapshot_path = config_data.get('snapshot_path', "")
+        snapshot_interval = config_data.get('snapshot_interval', 30)
+        if snapshot_path and snapshot_interval <= 0:
+            print(f"Error: 'snapshot_interval' must be positive, got {snapshot_interval}.")
+            return None
+
+        metrics_port = config_data.get('metrics_port', 0)
+        metrics_top_k = config_data.get('metrics_top_k', 20)
+        if metrics_top_k < 1:
+            print(f"Error: 'metrics_top_k' must be at least 1, got {metrics_top_k}.")
+            return None
+
+        trace_sample = config_data.get('trace_sample', 0)
+        if not 0 <= trace_sample <= 1:
+            print(f"Error: 'trace_sample' must be between 0 and 1, got {trace_sample}.")
+            return None
+
+        capture_path = config_data.get('capture_path', "")
+
         # Create the FederatorConfig object
         federator_config = FederatorConfig(
             redundancy=redundancy,
             cache_size=cache_size,
             host=host,
-            neighbors=neighbors
+            neighbors=neighbors,
+            transport=transport,
+            shards=shards,
+            wire_format=wire_format,
+            accept_pickle=accept_pickle,
+            host_subscriptions=host_subscriptions,
+            batch_linger_ms=batch_linger_ms,
+            batch_max_bytes=batch_max_bytes,
+            neighbor_max_inflight=neighbor_max_inflight,
+            neighbor_max_bytes=neighbor_max_bytes,
+            neighbor_overflow=neighbor_overflow,
+            worker_idle_ttl=worker_idle_ttl,
+            engine=engine,
+            pool_size=pool_size,
+            dedup_budget=dedup_budget,
+            control_priority=control_priority,
+            control_linger_ms=control_linger_ms,
+            core_refresh_ms=core_refresh_ms,
+            core_timeout_ms=core_timeout_ms,
+            snapshot_path=snapshot_path,
+            snapshot_interval=snapshot_interval,
+            metrics_port=metrics_port,
+            metrics_top_k=metrics_top_k,
+            trace_sample=trace_sample,
+            capture_path=capture_path
         )
 
         return federator_config
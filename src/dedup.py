@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+# An id this far behind the newest of its origin comes from an origin that
+# numbers from lower ids again (an earlier version numbering from 0, or a
+# clock set back), one less far behind is a late copy
+RESTART_GAP = 1 << 24
+
+
+def first_seqn() -> int:
+    """First publication id of a topic at this origin.
+
+    The clock in nanoseconds: a restarted origin numbers above anything its
+    previous incarnation handed out, so its publications slide the windows
+    forward instead of falling behind them.
+    """
+    return time.time_ns()
+
+
+class DedupWindow:
+    """Duplicate filter over the monotonic publication ids of each origin.
+
+    Per origin it keeps the highest sequence number seen and a bitmap of the
+    width numbers below it (bit n set = high - n seen). Anything newer slides
+    the window, anything inside it is a bit test. A sequence number behind the
+    window is a copy too late to tell and is dropped as seen, unless it is
+    RESTART_GAP behind: the origin then restarted its numbering and the window
+    is reset.
+    """
+    __slots__ = ('width', 'mask', 'origins')
+
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self.mask = (1 << width) - 1
+        # origin id -> [high-water mark, bitmap]
+        self.origins: Dict[int, List[int]] = {}
+
+    def seen(self, origin_id: int, seqn: int) -> bool:
+        """Records the id and tells whether it had already been recorded."""
+        window = self.origins.get(origin_id)
+        if window is None:
+            self.origins[origin_id] = [seqn, 1]
+            return False
+
+        high, bits = window
+        if seqn > high:
+            shift = seqn - high
+            window[0] = seqn
+            window[1] = ((bits << shift) | 1) & self.mask if shift < self.width else 1
+            return False
+
+        offset = high - seqn
+        if offset >= self.width:
+            if offset < RESTART_GAP:
+                return True
+            # Origin restarted from a lower sequence number
+            window[0] = seqn
+            window[1] = 1
+            return False
+
+        bit = 1 << offset
+        if bits & bit:
+            return True
+        window[1] = bits | bit
+        return False
+
+    def __str__(self) -> str:
+        return str({origin: f"{high}/{bits:b}" for origin, (high, bits) in self.origins.items()})
+
+
+# Estimated bytes held by a window besides its bitmap: dict slot, key, object
+WINDOW_OVERHEAD = 200
+MIN_WIDTH = 64
+MAX_WIDTH = 1 << 16
+DEDUP_REBALANCE_INTERVAL = 10
+
+
+class TopicWindow:
+    __slots__ = ('high', 'bits', 'width', 'count')
+
+    def __init__(self, seqn: int, width: int) -> None:
+        self.high = seqn
+        self.bits = 1
+        self.width = width
+        # Lookups since the last rebalance
+        self.count = 1
+
+    def cost(self) -> int:
+        return WINDOW_OVERHEAD + self.width // 8
+
+
+class DedupStore:
+    """Dedup windows of every topic and origin of the process under one byte budget.
+
+    Windows work like DedupWindow. New ones start width wide; every rebalance
+    resizes them in proportion to the lookups they had since the previous one,
+    so busy topics get long windows and quiet ones the minimum. When the
+    budget cannot hold every window the least used ones are evicted, across
+    all topics. A publication whose window was evicted is seen as new.
+    """
+    def __init__(self, budget: int, width: int) -> None:
+        self.budget = budget
+        self.width = min(max(width, MIN_WIDTH), MAX_WIDTH)
+        self.windows: Dict[Tuple[str, int], TopicWindow] = {}
+        # Keys ordered by traffic at the last rebalance, coldest last
+        self.cold: List[Tuple[str, int]] = []
+        self.used = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def seen(self, topic: str, origin_id: int, seqn: int) -> bool:
+        """Records the id and tells whether it had already been recorded."""
+        self.lookups += 1
+        window = self.windows.get((topic, origin_id))
+        if window is None:
+            self.admit((topic, origin_id), seqn)
+            return False
+
+        window.count += 1
+        if seqn > window.high:
+            shift = seqn - window.high
+            window.high = seqn
+            window.bits = ((window.bits << shift) | 1) & ((1 << window.width) - 1) if shift < window.width else 1
+            return False
+
+        offset = window.high - seqn
+        if offset >= window.width:
+            if offset < RESTART_GAP:
+                self.hits += 1
+                return True
+            # Origin restarted from a lower sequence number
+            window.high = seqn
+            window.bits = 1
+            return False
+
+        bit = 1 << offset
+        if window.bits & bit:
+            self.hits += 1
+            return True
+        window.bits |= bit
+        return False
+
+    def admit(self, key: Tuple[str, int], seqn: int) -> None:
+        window = TopicWindow(seqn, self.width)
+        while self.windows and self.used + window.cost() > self.budget:
+            self.evict()
+        self.windows[key] = window
+        self.used += window.cost()
+
+    def evict(self) -> None:
+        while self.cold:
+            window = self.windows.pop(self.cold.pop(), None)
+            if window is not None:
+                break
+        else:
+            # Nothing ranked yet, evict the oldest window
+            window = self.windows.pop(next(iter(self.windows)))
+        self.used -= window.cost()
+        self.evictions += 1
+
+    def rebalance(self) -> None:
+        ranked = sorted(self.windows.items(), key=lambda item: item[1].count, reverse=True)
+
+        keep = self.budget // (WINDOW_OVERHEAD + MIN_WIDTH // 8)
+        for key, _ in ranked[keep:]:
+            del self.windows[key]
+            self.evictions += 1
+        ranked = ranked[:keep]
+
+        spare = (self.budget - len(ranked) * (WINDOW_OVERHEAD + MIN_WIDTH // 8)) * 8
+        total = sum(window.count for _, window in ranked) or 1
+        self.used = 0
+        for _, window in ranked:
+            width = MIN_WIDTH + spare * window.count // total // 8 * 8
+            window.width = min(width, MAX_WIDTH)
+            window.bits &= (1 << window.width) - 1
+            window.count = 0
+            self.used += window.cost()
+
+        self.cold = [key for key, _ in ranked]
+
+
+async def maintain_store(store: DedupStore) -> None:
+    """Periodically rebalances the store and logs its counters."""
+    last_lookups, last_hits, last_evictions = 0, 0, 0
+    while True:
+        await asyncio.sleep(DEDUP_REBALANCE_INTERVAL)
+        store.rebalance()
+        logger.info(f"Dedup: windows={len(store.windows)} bytes={store.used}/{store.budget} "
+                    f"lookups={store.lookups - last_lookups} hits={store.hits - last_hits} "
+                    f"evictions={store.evictions - last_evictions}")
+        last_lookups, last_hits, last_evictions = store.lookups, store.hits, store.evictions
@@ -2,20 +2,36 @@ import logging
 import time
 import copy
 import asyncio
-import queue
-import threading
-from dataclasses import dataclass
-from typing import List, Dict
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple
 import paho.mqtt.client as mqtt
-from conf import FederatorConfig, BrokerConfig
-from message import deserialize, SubLog, FederatedPub, CoreAnn, MeshMembAnn
-from topics import CORE_ANNS, MEMB_ANNS, FEDERATED_TOPICS, ROUTING_TOPICS, SUB_LOGS
+from paho.mqtt.properties import Properties
+from conf import FederatorConfig, BrokerConfig, core_timeout
+from message import classify, decode, set_wire_format, is_control_topic, opens_topic, SubLog, UnsubLog, ClientNotice, FederatedPub, CoreAnn, MeshMembAnn, Tick
+from message import BATCH, CONTROL_BATCH, FEDERATED_PUB, SUB_LOG, UNSUB_LOG, NOTICE_LOG
+from topics import CORE_ANNS, MEMB_ANNS, FEDERATED_TOPICS, ROUTING_TOPICS, SUB_LOGS, SUB_LOGS_TOPIC_LEVEL, BATCHES
+from topics import PRUNES, UNSUB_LOGS, UNSUB_LOGS_TOPIC_LEVEL, NOTICE_LOGS
 from worker import TopicWorkerHandle
+from ingress import Ingress
+from transport import AsyncioHelper, TRANSPORT_THREAD, TRANSPORT_ASYNCIO, TRANSPORT_LOOPBACK
+from loopback import LoopbackClient
+from interest import HostInterest, is_own_sub_log, SUBSCRIBE_INTEREST
+from batch import LinkBatcher, ControlBatcher, classify_entries
+from channel import OutboundChannel, create_channels, report_links
+from pool import WorkerPool, ENGINE_POOL
+from dedup import DedupStore, maintain_store
+from filters import FilterIndex
+from timers import TimerWheel
+from metrics import Metrics, serve_metrics
+import snapshot
+from capture import Capture, open_capture, flush_capture
 
 # Constants
 HOST_QOS = 2
 NEIGHBORS_QOS = 2
 
+SUBSCRIPTION_LOGS = (SUB_LOGS_TOPIC_LEVEL, UNSUB_LOGS_TOPIC_LEVEL)
+
 logging.basicConfig(
         format='%(asctime)s [%(levelname)s] %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
@@ -23,64 +39,240 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-rx_queue = asyncio.Queue()
-sync_queue = queue.Queue()
-
 @dataclass
 class Context:
     id: int
     redundancy: int
     cache_size: int
-    neighbors: Dict[int, mqtt.Client]
+    neighbors: Dict[int, OutboundChannel]
     host_client: mqtt.Client
+    host_properties: Optional[Properties] = None
+    interest: Optional[HostInterest] = None
+    batchers: Optional[Dict[int, LinkBatcher]] = None
+    dedup: Optional[DedupStore] = None
+    # Federated topics and wildcard filters with a worker, shared by all workers
+    subscriptions: FilterIndex = field(default_factory=FilterIndex)
+    # Control messages overtake publications in the worker queues
+    control_priority: bool = False
+    control_batchers: Optional[Dict[int, ControlBatcher]] = None
+    # Core refresh and liveness, off without timers
+    timers: Optional[TimerWheel] = None
+    core_refresh: float = 0
+    core_timeout: float = 0
+    metrics: Optional[Metrics] = None
+    # Fraction of local publications traced through the mesh
+    trace_sample: float = 0
+
+    async def send_control(self, id: int, topic: str, payload) -> None:
+        """Sends an announcement to a neighbor, through its control batcher if there is one."""
+        if self.control_batchers is not None:
+            await self.control_batchers[id].add(topic, payload)
+        else:
+            await self.neighbors[id].publish(topic, payload, NEIGHBORS_QOS, control=True)
 
 
 class Federator:
-    def __init__(self, ctx:Context, topic_queues:Dict[str, asyncio.Queue]={}) -> None:
+    def __init__(self, ctx:Context, ingress:Ingress, idle_ttl:float=0, pool_size:int=0, snapshot_path:str="", snapshot_interval:float=0, capture:Optional[Capture]=None, helpers:Optional[List[AsyncioHelper]]=None) -> None:
         self.ctx = ctx
-        self.topic_queues = topic_queues
+        self.ingress = ingress
+        self.idle_ttl = idle_ttl
+        self.workers: Dict[str, TopicWorkerHandle] = {}
+        # Routing state of reaped workers, see TopicWorker.hibernate(), or
+        # snapshot records not decoded yet
+        self.hibernated: Dict[str, object] = {}
+        # Alternative engine: fixed consumers instead of a task per topic
+        self.pool = WorkerPool(ctx, pool_size) if pool_size > 0 else None
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        # Inbound messages recorded for replay, see capture.py
+        self.capture = capture
+        # Loop drivers of the clients with the asyncio transport
+        self.helpers = helpers or []
 
 
     async def run(self):
         await self.subscribe()
 
+        self.start_engine()
+
         while True:
             logger.debug("Waiting messages...")
-            mqtt_msg = await rx_queue.get()
-            try:
-                federated_topic, msg = deserialize(mqtt_msg)
-                if federated_topic is None:
-                    continue
-            except Exception as e:
-                logger.error(e)
-                continue
-
-            # Creating queues and workers
-            if federated_topic in self.topic_queues:
-                logger.debug(f"A Queue for topic {federated_topic} alredy exist, pushing message to queue...")
-                await self.topic_queues[federated_topic].put(msg)
-            elif isinstance(msg, SubLog) or isinstance(msg, CoreAnn):
-                logger.debug(f"Creating a new Queue and task to handle {federated_topic} messages...")
-                worker = TopicWorkerHandle(federated_topic, copy.copy(self.ctx))
-                queue = worker.get_queue()
-                self.topic_queues[federated_topic] = queue
-                await queue.put(msg)
-            else:
+            batch = await self.ingress.get_batch()
+            for mqtt_msg in batch:
+                await self.dispatch(mqtt_msg)
+
+
+    async def dispatch(self, mqtt_msg: mqtt.MQTTMessage) -> None:
+        if mqtt_msg.topic in SUBSCRIPTION_LOGS and is_own_sub_log(mqtt_msg.payload, self.ctx.id):
+            return
+
+        try:
+            kind, federated_topic = classify(mqtt_msg.topic, mqtt_msg.payload)
+            if federated_topic is None:
+                return
+
+            metrics = self.ctx.metrics
+            if kind == BATCH or kind == CONTROL_BATCH:
+                for kind, federated_topic, payload in classify_entries(mqtt_msg.payload):
+                    if metrics is not None:
+                        metrics.received[kind] += 1
+                    self.route(federated_topic, decode(kind, payload))
+                return
+
+            if metrics is not None:
+                metrics.received[kind] += 1
+            msg = decode(kind, mqtt_msg.payload)
+        except Exception as e:
+            logger.error(e)
+            return
+
+        self.deliver(kind, federated_topic, msg)
+
+
+    def deliver(self, kind: int, federated_topic: str, msg) -> None:
+        if kind == FEDERATED_PUB:
+            self.publish(federated_topic, msg)
+        elif kind == SUB_LOG:
+            self.ctx.subscriptions.subscribe(federated_topic, msg.client_id())
+            self.route(federated_topic, msg)
+        elif kind == UNSUB_LOG:
+            if self.ctx.subscriptions.unsubscribe(federated_topic, msg.client_id()):
+                self.route(federated_topic, msg)
+        elif kind == NOTICE_LOG:
+            self.client_notice(msg)
+        else:
+            self.route(federated_topic, msg)
+
+
+    def client_notice(self, notice: ClientNotice) -> None:
+        if notice.connected:
+            lost = self.ctx.subscriptions.connected(notice.client_id, notice.persistent)
+        else:
+            lost = self.ctx.subscriptions.disconnected(notice.client_id)
+
+        # Workers only learn that their topic has no local subscriber left
+        for topic_filter in lost:
+            logger.debug(f"Client {notice.client_id} gone, {topic_filter} has no local subscribers")
+            self.route(topic_filter, UnsubLog(str(notice)))
+
+
+    def publish(self, topic: str, msg: FederatedPub) -> None:
+        # A publication belongs to the mesh of every filter it matches
+        msg.topic = topic
+        for topic_filter in self.ctx.subscriptions.match(topic):
+            self.route(topic_filter, msg)
+
+
+    def route(self, federated_topic: str, msg) -> None:
+        if isinstance(msg, Tick) and federated_topic in self.hibernated:
+            # Timer of the worker before it hibernated, restore() arms a new one
+            return
+        if self.ctx.metrics is not None:
+            self.ctx.metrics.topics.add(federated_topic)
+        if isinstance(msg, SubLog) or isinstance(msg, CoreAnn):
+            self.ctx.subscriptions.add(federated_topic)
+
+        if self.pool is not None:
+            if federated_topic in self.hibernated and federated_topic not in self.pool.table:
+                self.revive(federated_topic)
+            if not self.pool.route(federated_topic, msg, opens_topic(msg)):
                 logger.error("Message received not dispatched and no new worker was created!")
+            return
+
+        # Creating queues and workers
+        worker = self.workers.get(federated_topic)
+        if worker is not None:
+            logger.debug(f"A Queue for topic {federated_topic} alredy exist, pushing message to queue...")
+            worker.get_queue().put_nowait(msg)
+        elif federated_topic in self.hibernated:
+            logger.debug(f"Reviving hibernated worker for {federated_topic}...")
+            self.revive(federated_topic)
+            self.workers[federated_topic].get_queue().put_nowait(msg)
+        elif opens_topic(msg):
+            logger.debug(f"Creating a new Queue and task to handle {federated_topic} messages...")
+            self.spawn(federated_topic).put_nowait(msg)
+        else:
+            logger.error("Message received not dispatched and no new worker was created!")
+
+
+    def spawn(self, federated_topic: str, state: tuple = None) -> asyncio.Queue:
+        worker = TopicWorkerHandle(federated_topic, copy.copy(self.ctx), state)
+        self.workers[federated_topic] = worker
+        return worker.get_queue()
+
+
+    def revive(self, federated_topic: str) -> None:
+        state = self.hibernated.pop(federated_topic)
+        if not isinstance(state, tuple):
+            state = snapshot.decode_state(state)
+        if self.pool is not None:
+            self.pool.restore(federated_topic, state)
+        else:
+            self.spawn(federated_topic, state)
+
+
+    def states(self):
+        """(topic, routing state) of every topic, active or not."""
+        for topic, worker in self.workers.items():
+            yield topic, worker.worker.hibernate()
+        yield from self.hibernated.items()
+        if self.pool is not None:
+            for topic, worker in self.pool.table.items():
+                yield topic, worker.hibernate()
+
+
+    def load_snapshot(self) -> None:
+        records = snapshot.load(self.snapshot_path)
+        for topic, (record, clients) in records.items():
+            # Topics stay undecoded until their first message
+            self.ctx.subscriptions.add(topic)
+            # Their unsubscribe and disconnect logs must still reach them
+            for client_id, persistent in clients:
+                self.ctx.subscriptions.subscribe(topic, client_id)
+                if persistent:
+                    self.ctx.subscriptions.persistent.add(client_id)
+            self.hibernated[topic] = record
+            if snapshot.has_mesh(record) and self.ctx.interest is not None:
+                self.ctx.interest.add(topic)
+            if snapshot.is_own_core(record) and self.ctx.timers is not None:
+                # Cores must keep refreshing their mesh
+                self.revive(topic)
+        if records:
+            logger.info(f"Restored the routing state of {len(records)} topics from {self.snapshot_path}")
+
+
+    def write_snapshot(self) -> None:
+        snapshot.write(self.snapshot_path, snapshot.encode(self.states(), self.ctx.id, self.ctx.subscriptions))
+
+
+    def start_engine(self) -> None:
+        if self.ctx.timers is not None:
+            self.ctx.timers.start(self.route)
+
+        if self.pool is not None:
+            self.pool.start()
+        elif self.idle_ttl > 0:
+            asyncio.create_task(self.reap())
+
+        if self.snapshot_path:
+            self.load_snapshot()
+            asyncio.create_task(snapshot.write_snapshots(self, self.snapshot_path, self.snapshot_interval))
+
+
+    async def reap(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.idle_ttl / 2, 1))
+            now = time.monotonic()
+            idle = [topic for topic, worker in self.workers.items() if worker.idle_for(now) >= self.idle_ttl]
+            for topic in idle:
+                self.hibernated[topic] = self.workers.pop(topic).stop()
+            if idle:
+                logger.info(f"Hibernated {len(idle)} idle workers ({len(self.workers)} active, {len(self.hibernated)} hibernated)")
 
 
 
     async def subscribe(self) -> None:
-        logger.debug("Subscribing host to topics...")
-        topics = [
-            FEDERATED_TOPICS, 
-            SUB_LOGS
-        ]
-        
-        for topic in topics:
-            self.ctx.host_client.subscribe(topic, options=mqtt.SubscribeOptions(qos=HOST_QOS, noLocal=True))
-            logger.info(f"{topic} Subscribed on host Broker!")
-        
+        subscribe_host(self.ctx.host_client, self.ctx.interest is not None and self.ctx.interest.enabled)
 
         # for id, n_client in self.ctx.neighbors.items():
         #     for topic in topics:
@@ -89,24 +281,54 @@ class Federator:
         
 
 
-async def bridge_queues():
-    logger.info("Task bridge queues started!")
-    while True:
-        while not sync_queue.empty():
-            item = sync_queue.get()
-            await rx_queue.put(item)
-        await asyncio.sleep(0.001)  # avoid busy-waiting
+def subscribe_host(host_client: mqtt.Client, interest: bool = False) -> None:
+    logger.debug("Subscribing host to topics...")
+    if interest:
+        # Federated topics are added one by one as their mesh becomes active
+        topics = [
+            CORE_ANNS,
+            MEMB_ANNS,
+            ROUTING_TOPICS,
+            BATCHES,
+            PRUNES,
+            SUB_LOGS,
+            UNSUB_LOGS,
+            NOTICE_LOGS
+        ]
+    else:
+        topics = [
+            FEDERATED_TOPICS, 
+            SUB_LOGS,
+            UNSUB_LOGS,
+            NOTICE_LOGS
+        ]
+    
+    for topic in topics:
+        host_client.subscribe(topic, options=mqtt.SubscribeOptions(qos=HOST_QOS, noLocal=True))
+        logger.info(f"{topic} Subscribed on host Broker!")
+
+
+def is_control_mqtt(mqtt_msg: mqtt.MQTTMessage) -> bool:
+    return is_control_topic(mqtt_msg.topic)
+
+
+def client_name(id: int, shard: Optional[int]) -> str:
+    return f"Federator #{id}" if shard is None else f"Federator #{id} Shard {shard}"
+
 
+def client_class(transport: str) -> type:
+    # Loopback clients take the same arguments and methods as paho's
+    return LoopbackClient if transport == TRANSPORT_LOOPBACK else mqtt.Client
 
 
-def create_neighbors_clients(configs: FederatorConfig) -> Dict[int, mqtt.Client]:
+def create_neighbors_clients(configs: FederatorConfig, shard: Optional[int] = None) -> Dict[int, mqtt.Client]:
     neighbors = {}
 
     for neigh_conf in configs.neighbors:
         logger.debug(f"Creating client for Neighbor Broker {neigh_conf.id, neigh_conf.ip}")
         try:
-            client = mqtt.Client(
-                client_id=f"Federator #{configs.host.id} Neighbor client {neigh_conf.id}",
+            client = client_class(configs.transport)(
+                client_id=f"{client_name(configs.host.id, shard)} Neighbor client {neigh_conf.id}",
                 protocol=mqtt.MQTTv5
             )
             neighbors[neigh_conf.id] = client
@@ -116,9 +338,9 @@ def create_neighbors_clients(configs: FederatorConfig) -> Dict[int, mqtt.Client]
     return neighbors
 
 
-def create_host_client(id: int) -> mqtt.Client:
-    client = mqtt.Client(
-        client_id=f"Federator #{id} Host client {id}",
+def create_host_client(id: int, shard: Optional[int] = None, transport: str = TRANSPORT_THREAD) -> mqtt.Client:
+    client = client_class(transport)(
+        client_id=f"{client_name(id, shard)} Host client {id}",
         protocol=mqtt.MQTTv5
     )
     
@@ -130,55 +352,163 @@ def connect_host(client: mqtt.Client, ip: str, port: int) -> None:
     logger.info("Connected to host Broker!")
 
 
-def connect_neighbor(id: int, client: mqtt.Client, ip: str, port: int) -> None:
+def connect_neighbor(id: int, client: mqtt.Client, ip: str, port: int, threaded: bool = True) -> None:
     client.connect(host=ip, port=port, keepalive=60)
     logger.info(f"Connected to neighbor broker {id}!")
-    client.loop_start()
+    if threaded:
+        client.loop_start()
 
 
-def connect_neighbors(neighbors_clients: Dict[int, mqtt.Client], n_configs: List[BrokerConfig]) -> None:
+def connect_neighbors(neighbors_clients: Dict[int, mqtt.Client], n_configs: List[BrokerConfig], threaded: bool = True) -> None:
     for n_config in n_configs:
-        connect_neighbor(n_config.id, neighbors_clients[n_config.id], n_config.ip, n_config.port)
+        connect_neighbor(n_config.id, neighbors_clients[n_config.id], n_config.ip, n_config.port, threaded)
 
 
-# Callback for when a message is received from the server.
-def on_message(client, userdata, msg: mqtt.MQTTMessage):
-    # logger.debug(f"New message in topic {msg.topic}. Message: {msg} CLIENT TYPE: [{userdata['client_type']}] MID: [{msg.mid}]")
-    sync_queue.put(msg)
+def create_neighbors_channels(loop: asyncio.AbstractEventLoop, config: FederatorConfig, neighbors_clients: Dict[int, mqtt.Client]) -> Dict[int, OutboundChannel]:
+    return create_channels(neighbors_clients, loop, config.neighbor_max_inflight, config.neighbor_max_bytes, config.neighbor_overflow)
 
 
-def run(config: FederatorConfig) -> None:
-    logger.info("Starting federator...")
+def create_batchers(config: FederatorConfig, channels: Dict[int, OutboundChannel]) -> Optional[Dict[int, LinkBatcher]]:
+    if config.batch_linger_ms <= 0:
+        return None
+
+    return {
+        id: LinkBatcher(id, channel, config.host.id, config.batch_linger_ms / 1000, config.batch_max_bytes)
+        for id, channel in channels.items()
+    }
+
+
+def create_dedup_store(config: FederatorConfig, parts: int = 1) -> Optional[DedupStore]:
+    if config.dedup_budget <= 0:
+        return None
+
+    return DedupStore(config.dedup_budget // parts, config.cache_size)
+
+
+def create_control_batchers(config: FederatorConfig, channels: Dict[int, OutboundChannel]) -> Optional[Dict[int, ControlBatcher]]:
+    if config.control_linger_ms <= 0:
+        return None
+
+    return {
+        id: ControlBatcher(id, channel, config.host.id, config.control_linger_ms / 1000, config.batch_max_bytes)
+        for id, channel in channels.items()
+    }
 
-    neighbors_clients = create_neighbors_clients(config)
 
-    host_client = create_host_client(config.host.id)
+def create_timers(config: FederatorConfig) -> Optional[TimerWheel]:
+    if config.core_refresh_ms <= 0:
+        return None
+
+    # A few ticks per refresh period keep the timers accurate enough
+    return TimerWheel(config.core_refresh_ms / 4000)
+
+
+def attach_asyncio_helpers(loop: asyncio.AbstractEventLoop, host_client: mqtt.Client, neighbors_clients: Dict[int, mqtt.Client]) -> List[AsyncioHelper]:
+    helpers = [AsyncioHelper(loop, host_client, "Host client")]
+    for id, client in neighbors_clients.items():
+        helpers.append(AsyncioHelper(loop, client, f"Neighbor client {id}"))
+    return helpers
+
+
+def start_clients(loop: asyncio.AbstractEventLoop, config: FederatorConfig, on_message=None, shard: Optional[int] = None, with_neighbors: bool = True) -> Tuple[mqtt.Client, Dict[int, mqtt.Client], List[AsyncioHelper]]:
+    neighbors_clients = create_neighbors_clients(config, shard) if with_neighbors else {}
+
+    host_client = create_host_client(config.host.id, shard, config.transport)
+
+    threaded = config.transport == TRANSPORT_THREAD
+    helpers = []
+    if config.transport == TRANSPORT_ASYNCIO:
+        # Sockets of every client are served by this loop, no network threads
+        helpers = attach_asyncio_helpers(loop, host_client, neighbors_clients)
+        logger.info("Using asyncio transport for host and neighbors")
 
     connect_host(host_client, config.host.ip, config.host.port)
 
-    host_client.on_message = on_message
+    if on_message is not None:
+        host_client.on_message = on_message
+
+    if threaded:
+        host_client.loop_start()
 
-    host_client.loop_start()
+    connect_neighbors(neighbors_clients, [n for n in config.neighbors if n.id in neighbors_clients], threaded)
 
-    connect_neighbors(neighbors_clients, config.neighbors)
+    return host_client, neighbors_clients, helpers
+
+
+def start(loop: asyncio.AbstractEventLoop, config: FederatorConfig) -> Federator:
+    """Connects the clients of a federator and schedules its tasks on loop."""
+    ingress = Ingress(loop, is_control_mqtt if config.control_priority else None)
+
+    capture = open_capture(config.capture_path, config.host.id) if config.capture_path else None
+    on_message = capture.tap(ingress.on_message) if capture is not None else ingress.on_message
+
+    host_client, neighbors_clients, helpers = start_clients(loop, config, on_message)
+
+    neighbors = create_neighbors_channels(loop, config, neighbors_clients)
     
     ctx = Context(
         id=config.host.id,
         redundancy=config.redundancy,
         cache_size=config.cache_size,
-        neighbors=neighbors_clients, #Lock
-        host_client=host_client
+        neighbors=neighbors,
+        host_client=host_client,
+        interest=HostInterest(host_client, config.host_subscriptions == SUBSCRIBE_INTEREST),
+        batchers=create_batchers(config, neighbors),
+        dedup=create_dedup_store(config),
+        control_priority=config.control_priority,
+        control_batchers=create_control_batchers(config, neighbors),
+        timers=create_timers(config),
+        core_refresh=config.core_refresh_ms / 1000,
+        core_timeout=core_timeout(config),
+        metrics=Metrics(config.metrics_top_k) if config.metrics_port else None,
+        trace_sample=config.trace_sample
     )
 
     federator = Federator(
-        ctx=ctx
+        ctx=ctx,
+        ingress=ingress,
+        idle_ttl=config.worker_idle_ttl,
+        pool_size=config.pool_size if config.engine == ENGINE_POOL else 0,
+        snapshot_path=config.snapshot_path,
+        snapshot_interval=config.snapshot_interval,
+        capture=capture,
+        helpers=helpers
     )
 
-    loop = asyncio.get_event_loop()
+    loop.create_task(federator.run())
+
+    loop.create_task(report_links(neighbors))
+
+    if ctx.dedup is not None:
+        loop.create_task(maintain_store(ctx.dedup))
+
+    if ctx.metrics is not None:
+        loop.create_task(serve_metrics(federator, config.metrics_port))
 
-    loop.create_task(bridge_queues())
+    if capture is not None:
+        loop.create_task(flush_capture(capture))
 
-    asyncio.ensure_future(federator.run())
+    return federator
+
+
+def run(config: FederatorConfig) -> None:
+    run_federation([config])
+
+
+def run_federation(configs: List[FederatorConfig]) -> None:
+    """Runs federators on one event loop, a whole federation with loopback brokers."""
+    if len(configs) == 1:
+        logger.info("Starting federator...")
+    else:
+        logger.info(f"Starting {len(configs)} federators...")
+
+    # The wire format is process-wide
+    set_wire_format(configs[0].wire_format, configs[0].accept_pickle)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    federators = [(config, start(loop, config)) for config in configs]
 
     # Run the event loop until it's stopped
     try:
@@ -186,12 +516,13 @@ def run(config: FederatorConfig) -> None:
     except KeyboardInterrupt:
         pass
 
+    for config, federator in federators:
+        if config.snapshot_path:
+            federator.write_snapshot()
+        if federator.capture is not None:
+            federator.capture.close()
+        for helper in federator.helpers:
+            helper.close()
+
     # Close the event loop
     loop.close()
-
-
-
-
-
-    
-
@@ -0,0 +1,118 @@
+from typing import Dict, List
+
+# Node layout: [children by topic level, filter ending at this node]
+CHILDREN = 0
+FILTER = 1
+
+
+def is_wildcard(topic_filter: str) -> bool:
+    return '+' in topic_filter or '#' in topic_filter
+
+
+class FilterIndex:
+    """Trie of the federated topic filters with a mesh, exact topics and wildcards alike.
+
+    match() walks the publication topic level by level, following the literal
+    level and the '+' branch and collecting '#' leaves, so its cost depends on
+    the topic depth and not on how many filters are known.
+    """
+    def __init__(self) -> None:
+        self.root = [{}, None]
+        self.filters = set()
+        # Clients subscribed on the host broker, by filter and filters by client
+        self.local: Dict[str, set] = {}
+        self.clients: Dict[str, set] = {}
+        # Clients whose subscriptions outlive their connection
+        self.persistent = set()
+
+    def __contains__(self, topic_filter: str) -> bool:
+        return topic_filter in self.filters
+
+    def add(self, topic_filter: str) -> None:
+        if topic_filter in self.filters:
+            return
+        self.filters.add(topic_filter)
+
+        node = self.root
+        for level in topic_filter.split('/'):
+            node = node[CHILDREN].setdefault(level, [{}, None])
+        node[FILTER] = topic_filter
+
+    def subscribe(self, topic_filter: str, client_id: str) -> None:
+        self.local.setdefault(topic_filter, set()).add(client_id)
+        self.clients.setdefault(client_id, set()).add(topic_filter)
+
+    def unsubscribe(self, topic_filter: str, client_id: str) -> bool:
+        """Whether this was the last local subscriber of the filter."""
+        filters = self.clients.get(client_id)
+        if filters is None or topic_filter not in filters:
+            return False
+        filters.discard(topic_filter)
+        if not filters:
+            del self.clients[client_id]
+
+        subscribers = self.local[topic_filter]
+        subscribers.discard(client_id)
+        if subscribers:
+            return False
+        del self.local[topic_filter]
+        return True
+
+    def drop_client(self, client_id: str) -> List[str]:
+        """Forgets every subscription of a client, returns the filters left without subscribers."""
+        return [f for f in list(self.clients.get(client_id, ())) if self.unsubscribe(f, client_id)]
+
+    def connected(self, client_id: str, persistent: bool) -> List[str]:
+        # A clean session discards whatever the previous one had subscribed
+        lost = [] if persistent else self.drop_client(client_id)
+        if persistent:
+            self.persistent.add(client_id)
+        else:
+            self.persistent.discard(client_id)
+        return lost
+
+    def disconnected(self, client_id: str) -> List[str]:
+        if client_id in self.persistent:
+            return []
+        return self.drop_client(client_id)
+
+    def match(self, topic: str) -> List[str]:
+        """Returns the known filters matching a publication topic."""
+        levels = topic.split('/')
+        depth = len(levels)
+        matches = []
+        # Wildcards at the first level do not match $ topics
+        pending = [(self.root, 0, not topic.startswith('$'))]
+        while pending:
+            node, i, wildcards = pending.pop()
+            children = node[CHILDREN]
+
+            if wildcards:
+                rest = children.get('#')
+                # "a/#" also matches "a"
+                if rest is not None and rest[FILTER] is not None:
+                    matches.append(rest[FILTER])
+
+            if i == depth:
+                if node[FILTER] is not None:
+                    matches.append(node[FILTER])
+                continue
+
+            child = children.get(levels[i])
+            if child is not None:
+                pending.append((child, i + 1, True))
+            if wildcards:
+                child = children.get('+')
+                if child is not None:
+                    pending.append((child, i + 1, True))
+
+        return matches
+
+    def delivers(self, topic_filter: str, topic: str) -> bool:
+        """Whether the mesh of topic_filter is the one delivering topic to the host.
+
+        A publication reaches this broker through the mesh of every matching
+        filter with local subscribers. The host broker already hands it to all
+        of them, so only the smallest such filter delivers it.
+        """
+        return min((f for f in self.match(topic) if f in self.local), default=topic_filter) == topic_filter
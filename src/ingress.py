@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from collections import deque
+from typing import List, Callable, Optional
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MAX_BATCH = 1024
+
+
+class Ingress:
+    """Hands inbound MQTT messages from the paho network threads to the event loop.
+
+    Producers append to a deque and only schedule a wakeup on the loop when
+    none is pending, so a burst of messages costs a single loop wakeup and the
+    consumer drains everything that accumulated in one batch.
+
+    With an is_control predicate, control messages go to a second deque that
+    is drained first, so they overtake publications already waiting.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, is_control: Optional[Callable] = None) -> None:
+        self.loop = loop
+        self.is_control = is_control
+        self.pending = deque()
+        self.control = deque()
+        self.waiter = None
+        self.signalled = False
+
+    # Callback for when a message is received from the server (paho thread).
+    def on_message(self, client, userdata, msg) -> None:
+        self.put(msg)
+
+    def put(self, msg) -> None:
+        if self.is_control is not None and self.is_control(msg):
+            self.control.append(msg)
+        else:
+            self.pending.append(msg)
+        # The flag is only a hint to coalesce wakeups: a stale read costs one
+        # spurious wakeup, never a lost message, since the consumer always
+        # re-checks the deque after waking up.
+        if not self.signalled:
+            self.signalled = True
+            if self.on_loop_thread():
+                # asyncio transport: already running inside the loop
+                self.wakeup()
+            else:
+                self.loop.call_soon_threadsafe(self.wakeup)
+
+    def on_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def wakeup(self) -> None:
+        self.signalled = False
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def qsize(self) -> int:
+        return len(self.control) + len(self.pending)
+
+    async def get_batch(self, max_items: int = MAX_BATCH) -> List:
+        while not self.pending and not self.control:
+            self.waiter = self.loop.create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+
+        batch = []
+        for pending in (self.control, self.pending):
+            while pending and len(batch) < max_items:
+                batch.append(pending.popleft())
+
+        return batch
+
+
+class PriorityLanes(asyncio.Queue):
+    """asyncio.Queue handing out control items before data items, each lane in FIFO order."""
+    def __init__(self, is_control: Callable) -> None:
+        self.is_control = is_control
+        super().__init__()
+
+    def _init(self, maxsize) -> None:
+        self._queue = deque()
+        self._control = deque()
+
+    def _put(self, item) -> None:
+        if self.is_control(item):
+            self._control.append(item)
+        else:
+            self._queue.append(item)
+
+    def _get(self):
+        if self._control:
+            return self._control.popleft()
+        return self._queue.popleft()
+
+    def qsize(self) -> int:
+        return len(self._control) + len(self._queue)
+
+    def empty(self) -> bool:
+        return not self._control and not self._queue
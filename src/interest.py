@@ -0,0 +1,47 @@
+import logging
+import paho.mqtt.client as mqtt
+
+HOST_QOS = 2
+
+SUBSCRIBE_ALL = "all"
+SUBSCRIBE_INTEREST = "interest"
+SUBSCRIPTION_MODES = (SUBSCRIBE_ALL, SUBSCRIBE_INTEREST)
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class HostInterest:
+    """Keeps the host client subscribed to exactly the federated topics with an active mesh.
+
+    Only used with the "interest" subscription mode; with "all" the host is
+    subscribed to every topic and this does nothing.
+    """
+    def __init__(self, host_client: mqtt.Client, enabled: bool) -> None:
+        self.host_client = host_client
+        self.enabled = enabled
+        self.topics = set()
+
+    def add(self, federated_topic: str) -> None:
+        if not self.enabled or federated_topic in self.topics:
+            return
+        self.topics.add(federated_topic)
+        self.host_client.subscribe(federated_topic, options=mqtt.SubscribeOptions(qos=HOST_QOS, noLocal=True))
+        logger.info(f"{federated_topic} Subscribed on host Broker!")
+
+    def discard(self, federated_topic: str) -> None:
+        if federated_topic not in self.topics:
+            return
+        self.topics.discard(federated_topic)
+        self.host_client.unsubscribe(federated_topic)
+        logger.info(f"{federated_topic} Unsubscribed on host Broker!")
+
+
+def is_own_sub_log(payload: bytes, id: int) -> bool:
+    """Whether a subscribe log entry comes from one of this federator's own clients."""
+    # Client ids are "Federator #<id> ...", the trailing space keeps #1 from matching #10
+    return f"Federator #{id} ".encode('utf-8') in payload
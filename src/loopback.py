@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Tuple
+import paho.mqtt.client as mqtt
+from filters import FilterIndex
+from topics import SUB_LOGS_TOPIC_LEVEL, UNSUB_LOGS_TOPIC_LEVEL, NOTICE_LOGS_TOPIC_LEVEL
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class PublishInfo:
+    __slots__ = ('rc', 'mid')
+
+    def __init__(self, rc: int, mid: int) -> None:
+        self.rc = rc
+        self.mid = mid
+
+
+def current_loop() -> asyncio.AbstractEventLoop:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.get_event_loop()
+
+
+class LoopbackBroker:
+    """In-process stand-in for a mosquitto broker.
+
+    Delivers publications to the clients whose subscriptions match, with
+    wildcards, $ topics and noLocal handled as mosquitto does, each client
+    getting a message once however many of its filters match. Subscribe,
+    unsubscribe and connection events are published as the $SYS log topics
+    the federator listens to. Retained messages and sessions are not kept.
+    Messages are handed over on the event loop, never synchronously.
+    """
+    def __init__(self, address: Tuple[str, int]) -> None:
+        self.address = address
+        self.filters = FilterIndex()
+        # Filter -> client -> noLocal
+        self.subscribers: Dict[str, Dict['LoopbackClient', bool]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    def connect(self, client: 'LoopbackClient') -> None:
+        self.log(NOTICE_LOGS_TOPIC_LEVEL, f"New client connected from {self.address[0]}:0 as {client.client_id} (p5, c1, k60).")
+
+    def disconnect(self, client: 'LoopbackClient') -> None:
+        for subscribers in self.subscribers.values():
+            subscribers.pop(client, None)
+        self.log(NOTICE_LOGS_TOPIC_LEVEL, f"Client {client.client_id} disconnected.")
+
+    def subscribe(self, client: 'LoopbackClient', topic_filter: str, qos: int, no_local: bool) -> None:
+        self.filters.add(topic_filter)
+        self.subscribers.setdefault(topic_filter, {})[client] = no_local
+        self.log(SUB_LOGS_TOPIC_LEVEL, f"{client.client_id} {qos} {topic_filter}")
+
+    def unsubscribe(self, client: 'LoopbackClient', topic_filter: str) -> None:
+        if self.subscribers.get(topic_filter, {}).pop(client, None) is not None:
+            self.log(UNSUB_LOGS_TOPIC_LEVEL, f"{client.client_id} {topic_filter}")
+
+    def log(self, topic: str, text: str) -> None:
+        self.publish(None, topic, f"{int(time.time())}: {text}".encode('utf-8'), 0, None)
+
+    def publish(self, sender, topic: str, payload: bytes, qos: int, properties) -> None:
+        self.published += 1
+        targets = set()
+        for topic_filter in self.filters.match(topic):
+            for client, no_local in self.subscribers[topic_filter].items():
+                if not (no_local and client is sender):
+                    targets.add(client)
+
+        loop = current_loop()
+        for client in targets:
+            msg = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+            msg.payload = payload
+            msg.qos = qos
+            if properties is not None:
+                msg.properties = properties
+            loop.call_soon(client.deliver, msg)
+        self.delivered += len(targets)
+
+
+# Brokers of the process by address, see broker()
+BROKERS: Dict[Tuple[str, int], LoopbackBroker] = {}
+
+
+def broker(ip: str, port: int) -> LoopbackBroker:
+    """The loopback broker at an address, created on first use."""
+    address = (ip, port)
+    if address not in BROKERS:
+        BROKERS[address] = LoopbackBroker(address)
+    return BROKERS[address]
+
+
+def reset() -> None:
+    """Forgets every loopback broker, e.g. between two runs in one process."""
+    BROKERS.clear()
+
+
+class LoopbackClient:
+    """Drop-in for the part of the paho client the federator uses, attached to a loopback broker."""
+    def __init__(self, client_id: str = "", protocol: int = mqtt.MQTTv5) -> None:
+        self.client_id = client_id
+        self.broker = None
+        self.on_message = None
+        self.on_publish = None
+        self.mid = 0
+
+    def connect(self, host: str, port: int = 1883, keepalive: int = 60) -> int:
+        self.broker = broker(host, port)
+        self.broker.connect(self)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def reconnect(self) -> int:
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def disconnect(self) -> int:
+        if self.broker is not None:
+            self.broker.disconnect(self)
+            self.broker = None
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self) -> None:
+        pass
+
+    def loop_stop(self) -> None:
+        pass
+
+    def max_inflight_messages_set(self, inflight: int) -> None:
+        pass
+
+    def subscribe(self, topic, qos=0, options=None, properties=None) -> Tuple[int, int]:
+        if options is not None:
+            qos, no_local = options.QoS, options.noLocal
+        else:
+            no_local = False
+        self.mid += 1
+        self.broker.subscribe(self, topic, qos, no_local)
+        return mqtt.MQTT_ERR_SUCCESS, self.mid
+
+    def unsubscribe(self, topic, properties=None) -> Tuple[int, int]:
+        self.mid += 1
+        self.broker.unsubscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, self.mid
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None) -> PublishInfo:
+        self.mid += 1
+        if self.broker is None:
+            return PublishInfo(mqtt.MQTT_ERR_NO_CONN, self.mid)
+
+        self.broker.publish(self, topic, bytes(payload) if payload is not None else b"", qos, properties)
+        if qos > 0 and self.on_publish is not None:
+            # Acknowledged once the broker took it, like a PUBACK
+            current_loop().call_soon(self.on_publish, self, None, self.mid)
+        return PublishInfo(mqtt.MQTT_ERR_SUCCESS, self.mid)
+
+    def deliver(self, msg: mqtt.MQTTMessage) -> None:
+        if self.on_message is not None:
+            self.on_message(self, None, msg)
@@ -1,7 +1,9 @@
 import logging
 import federator
+import shard
 import argparse
 from conf import read_config_file
+from transport import TRANSPORT_LOOPBACK
 
 logging.basicConfig(
         format='%(asctime)s [%(levelname)s] %(name)s %(message)s',
@@ -14,7 +16,7 @@ logger.setLevel(logging.INFO)
 # Parse command-line arguments
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Federator Configuration')
-    parser.add_argument('-c', '--config', type=str, help='Path to TOML configuration file')
+    parser.add_argument('-c', '--config', type=str, nargs='+', help='Path to TOML configuration file, several run a loopback federation in one process')
     return parser.parse_args()
 
 
@@ -23,13 +25,24 @@ if __name__ == "__main__":
 
     args = parse_arguments()
 
-    if args.config:
-        config = read_config_file(args.config)
-
-        if config is not None:
-            logger.debug(config)
-
-    else:
+    if not args.config:
         logger.error("Error: Please provide a TOML configuration file using the -c or --config argument.")
-
-    federator.run(config)
\ No newline at end of file
+        raise SystemExit(1)
+
+    configs = [read_config_file(path) for path in args.config]
+    if any(config is None for config in configs):
+        logger.error("Error: Could not load the configuration.")
+        raise SystemExit(1)
+
+    for config in configs:
+        logger.debug(config)
+
+    if len(configs) > 1:
+        if any(config.transport != TRANSPORT_LOOPBACK for config in configs):
+            logger.error("Error: Several configuration files can only be run together with the loopback transport.")
+            raise SystemExit(1)
+        federator.run_federation(configs)
+    elif configs[0].shards > 0:
+        shard.run(configs[0])
+    else:
+        federator.run(configs[0])
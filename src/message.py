@@ -1,11 +1,15 @@
 import paho.mqtt.client as mqtt
-import fnmatch
 import logging
 import pickle
-from typing import Tuple
+import re
+import struct
+from typing import Tuple, Optional
 from dataclasses import dataclass
-from topics import CORE_ANN_TOPIC_LEVEL, MEMB_ANN_TOPIC_LEVEL, FEDERATED_TOPICS_LEVEL, ROUTING_TOPICS_LEVEL, SUB_LOGS_TOPIC_LEVEL
-from topics import CORE_ANNS, MEMB_ANNS, ROUTING_TOPICS, SUB_LOGS, FEDERATED_TOPICS
+from topics import CORE_ANN_TOPIC_LEVEL, MEMB_ANN_TOPIC_LEVEL, FEDERATED_TOPICS_LEVEL, ROUTING_TOPICS_LEVEL, SUB_LOGS_TOPIC_LEVEL, BATCH_TOPIC_LEVEL
+from topics import PRUNE_TOPIC_LEVEL, UNSUB_LOGS_TOPIC_LEVEL, NOTICE_LOGS_TOPIC_LEVEL, CONTROL_BATCH_TOPIC_LEVEL
+from topics import CORE_ANNS, MEMB_ANNS, ROUTING_TOPICS, SUB_LOGS, FEDERATED_TOPICS, BATCHES, PRUNES, UNSUB_LOGS, NOTICE_LOGS
+from topics import escape_filter, unescape_filter
+from classifier import TopicClassifier
 
 
 logging.basicConfig(
@@ -15,12 +19,83 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Message kinds, as classified from the MQTT topic
+SUB_LOG = 0
+CORE_ANN = 1
+MEMB_ANN = 2
+ROUTED_PUB = 3
+FEDERATED_PUB = 4
+BATCH = 5
+UNSUB_LOG = 6
+NOTICE_LOG = 7
+PRUNE = 8
+CONTROL_BATCH = 9
+
+# Wire formats of CoreAnn, MeshMembAnn and RoutedPub payloads
+WIRE_PICKLE = "pickle"
+WIRE_BINARY = "binary"
+WIRE_FORMATS = (WIRE_PICKLE, WIRE_BINARY)
+
+# Binary frame: version, kind, flags, pad, core_id, dist, sender_id, origin_id, seqn.
+# RoutedPub frames carry the raw publication payload right after the header,
+# preceded by the length and name of the publication topic when FLAG_TOPIC is
+# set and by the trace when FLAG_TRACE is set. Frames with flags are version
+# 2, which decoders knowing only version 1 reject instead of misreading, the
+# others stay version 1.
+WIRE_VERSION = 1
+WIRE_VERSION_FLAGS = 2
+HEADER = struct.Struct("!BBBxIHIIQ")
+FLAG_TOPIC = 0x01
+TOPIC_LEN = struct.Struct("!H")
+# Sampled publications then carry their trace: origin time (microseconds since
+# the epoch) and hop count, then a broker id and microseconds since the
+# origin time for each broker that forwarded them.
+FLAG_TRACE = 0x02
+TRACE = struct.Struct("!QB")
+HOP = struct.Struct("!II")
+# Flags each version may carry. A flag may change the layout of the rest of
+# the frame: frames with any other flag set are rejected rather than misread
+FRAME_FLAGS = {WIRE_VERSION: 0, WIRE_VERSION_FLAGS: FLAG_TOPIC | FLAG_TRACE}
+MAX_HOPS = 255
+SENDER = struct.Struct("!I")
+SENDER_OFFSET = struct.calcsize("!BBBxIH")
+PICKLE_PROTO = 0x80  # first byte of any pickle of protocol 2 or newer
+
+# Mosquitto connection notices, "(p2, c1, k60)" means protocol 2, clean session, keepalive 60
+CONNECTED = re.compile(r"New client connected from \S+ as (.+) \(p\d+, c(\d)")
+DISCONNECTED = re.compile(r"Client (.+?) (?:disconnected|closed its connection|has exceeded timeout)")
+
+# Process-wide codec settings, see set_wire_format()
+wire_format = WIRE_PICKLE
+accept_pickle = True
+
+
+def set_wire_format(format: str, accept_legacy: bool = True) -> None:
+    """Selects the encoding of outgoing frames and whether pickled frames are still decoded.
+
+    Rolling a fleet over to the binary format: first deploy with
+    accept_legacy everywhere (binary frames are always decoded), then switch
+    wire_format to binary, then turn accept_legacy off.
+    """
+    global wire_format, accept_pickle
+    if format not in WIRE_FORMATS:
+        raise ValueError(f"Unknown wire format {format}")
+    wire_format = format
+    accept_pickle = accept_legacy
+
 # frozen=True make this dataclass immutable and give __hash__ method to class
 @dataclass(frozen=True)
 class PubId:
     origin_id:int
     seqn:int
 
+def log_text(payload) -> str:
+    """Text of a broker log message without its timestamp."""
+    text = payload.decode('utf-8') if isinstance(payload, (bytes, bytearray)) else payload
+    stamp, sep, rest = text.partition(': ')
+    return rest if sep and stamp.isdigit() else text
+
+
 class SubLog:
     def __init__(self, payload) -> None:
         self.payload = payload
@@ -28,12 +103,41 @@ class SubLog:
     def __str__(self) -> str:
         return f"SubLog(payload={self.payload})"
 
+    def client_id(self) -> str:
+        # "<client id> <qos> <topic>"
+        return log_text(self.payload).rsplit(' ', 2)[0]
+
+class UnsubLog:
+    """A subscription of the host broker went away, or the last of a topic when sent to a worker."""
+    def __init__(self, payload) -> None:
+        self.payload = payload
+
+    def __str__(self) -> str:
+        return f"UnsubLog(payload={self.payload})"
+
+    def client_id(self) -> str:
+        # "<client id> <topic>"
+        return log_text(self.payload).rsplit(' ', 1)[0]
+
+class ClientNotice:
+    """A client of the host broker connected or disconnected."""
+    def __init__(self, client_id: str, connected: bool, persistent: bool = False) -> None:
+        self.client_id = client_id
+        self.connected = connected
+        self.persistent = persistent
+
+    def __str__(self) -> str:
+        return f"ClientNotice(client_id={self.client_id}, connected={self.connected}, persistent={self.persistent})"
+
 class FederatedPub:
+    # Publication topic, set when it is routed to the filters it matches
+    topic = None
+
     def __init__(self, payload) -> None:
         self.payload = payload
 
     def __str__(self) -> str:
-        return f"FederatedPub(payload={self.payload})"
+        return f"FederatedPub(topic={self.topic}, payload={self.payload})"
     
     def serialize(self, fed_topic: str) -> Tuple[str, bytes]:
         topic = f"{FEDERATED_TOPICS_LEVEL}{fed_topic}"
@@ -41,17 +145,24 @@ class FederatedPub:
         return topic, self.payload
 
 class CoreAnn:
-    def __init__(self, core_id, dist, sender_id) -> None:
+    # Round of the core announcing, see worker.first_round(), 0 for legacy peers
+    seqn = 0
+
+    def __init__(self, core_id, dist, sender_id, seqn=0) -> None:
         self.core_id = core_id
         self.dist = dist
         self.sender_id = sender_id
+        self.seqn = seqn
 
     def __str__(self) -> str:
-        return f"CoreAnn(core_id={self.core_id}, dist={self.dist}, sender_id={self.sender_id})"
+        return f"CoreAnn(core_id={self.core_id}, dist={self.dist}, sender_id={self.sender_id}, seqn={self.seqn})"
 
     def serialize(self, fed_topic: str) -> Tuple[str, bytes]:
-        topic = f"{CORE_ANN_TOPIC_LEVEL}{fed_topic}"
-        payload = pickle.dumps(self)
+        topic = f"{CORE_ANN_TOPIC_LEVEL}{escape_filter(fed_topic)}"
+        if wire_format == WIRE_BINARY:
+            payload = HEADER.pack(WIRE_VERSION, CORE_ANN, 0, self.core_id, self.dist, self.sender_id, 0, self.seqn)
+        else:
+            payload = pickle.dumps(self)
 
         return topic, payload
     
@@ -64,72 +175,264 @@ class MeshMembAnn:
         return f"MeshMembAnn(core_id={self.core_id}, sender_id={self.sender_id})"
 
     def serialize(self, fed_topic: str) -> Tuple[str, bytes]:
-        topic = f"{MEMB_ANN_TOPIC_LEVEL}{fed_topic}"
-        payload = pickle.dumps(self)
+        topic = f"{MEMB_ANN_TOPIC_LEVEL}{escape_filter(fed_topic)}"
+        if wire_format == WIRE_BINARY:
+            payload = HEADER.pack(WIRE_VERSION, MEMB_ANN, 0, self.core_id, 0, self.sender_id, 0, 0)
+        else:
+            payload = pickle.dumps(self)
+
+        return topic, payload
+    
+class Tick:
+    """Liveness round of a topic worker, posted by the timer wheel, never sent.
+
+    Each worker schedules its own instance and ignores the others: the
+    wheel cannot cancel the timer of a worker that hibernated.
+    """
+    def __str__(self) -> str:
+        return "Tick()"
+
+class MeshPrune:
+    """Sent to the parents by a mesh member left without local subscribers nor children.
+
+    Sent by the core itself (sender_id == core_id) to every neighbor, and
+    flooded on, when the whole mesh lost interest: the core is withdrawn, and
+    its CoreAnns of rounds up to seqn are stale.
+    """
+    # Round of the withdrawal, 0 for member prunes
+    seqn = 0
+
+    def __init__(self, core_id:int, sender_id: int, seqn: int = 0) -> None:
+        self.core_id = core_id
+        self.sender_id = sender_id
+        self.seqn = seqn
+
+    def __str__(self) -> str:
+        return f"MeshPrune(core_id={self.core_id}, sender_id={self.sender_id}, seqn={self.seqn})"
+
+    def serialize(self, fed_topic: str) -> Tuple[str, bytes]:
+        topic = f"{PRUNE_TOPIC_LEVEL}{escape_filter(fed_topic)}"
+        if wire_format == WIRE_BINARY:
+            payload = HEADER.pack(WIRE_VERSION, PRUNE, 0, self.core_id, 0, self.sender_id, 0, self.seqn)
+        else:
+            payload = pickle.dumps(self)
 
         return topic, payload
     
 class RoutedPub:
-    def __init__(self, pub_id: PubId, sender_id:int, payload) -> None:
+    # Binary frame this RoutedPub was decoded from, payload is then a view into it
+    frame = None
+    # Publication topic when the mesh is a wildcard filter, None when it is the mesh topic
+    topic = None
+    # Sampled publications: (origin time in microseconds, ((broker id, microseconds since origin), ...))
+    trace = None
+
+    def __init__(self, pub_id: PubId, sender_id:int, payload, frame=None, topic=None, trace=None) -> None:
         self.pub_id = pub_id
         self.sender_id = sender_id
         self.payload = payload
+        self.frame = frame
+        self.topic = topic
+        self.trace = trace
 
     def __str__(self) -> str:
-        return f"RoutedPub(pub_id={self.pub_id}, sender_id={self.sender_id}, payload={self.payload})"
+        return f"RoutedPub(pub_id={self.pub_id}, sender_id={self.sender_id}, topic={self.topic}, trace={self.trace}, payload={bytes(self.payload)})"
+
+    def __getstate__(self):
+        # Same pickled shape as before binary frames existed, without the view
+        state = {'pub_id': self.pub_id, 'sender_id': self.sender_id, 'payload': bytes(self.payload)}
+        if self.topic is not None:
+            state['topic'] = self.topic
+        if self.trace is not None:
+            state['trace'] = self.trace
+        return state
+
+    def forward(self, fed_topic: str, sender_id: int) -> Tuple[str, bytes]:
+        """Serializes this RoutedPub as relayed by sender_id.
+
+        A received binary frame is copied once with only the sender field
+        patched; the payload is never decoded or re-encoded on the way.
+        """
+        if self.frame is None or wire_format != WIRE_BINARY or self.trace is not None:
+            # Traced frames grow by one hop and are rebuilt
+            self.sender_id = sender_id
+            return self.serialize(fed_topic)
+
+        frame = bytearray(self.frame)
+        SENDER.pack_into(frame, SENDER_OFFSET, sender_id)
+
+        return f"{ROUTING_TOPICS_LEVEL}{escape_filter(fed_topic)}", frame
 
     def serialize(self, fed_topic: str) -> Tuple[str, bytes]:
-        topic = f"{ROUTING_TOPICS_LEVEL}{fed_topic}"
-        payload = pickle.dumps(self)
+        topic = f"{ROUTING_TOPICS_LEVEL}{escape_filter(fed_topic)}"
+        if wire_format == WIRE_BINARY and (self.topic is not None or self.trace is not None):
+            flags = 0
+            parts = [None]
+            if self.topic is not None:
+                flags |= FLAG_TOPIC
+                pub_topic = self.topic.encode('utf-8')
+                parts.append(TOPIC_LEN.pack(len(pub_topic)))
+                parts.append(pub_topic)
+            if self.trace is not None:
+                flags |= FLAG_TRACE
+                origin, hops = self.trace
+                parts.append(TRACE.pack(origin, len(hops)))
+                parts.extend(HOP.pack(*hop) for hop in hops)
+            parts[0] = HEADER.pack(WIRE_VERSION_FLAGS, ROUTED_PUB, flags, 0, 0, self.sender_id, self.pub_id.origin_id, self.pub_id.seqn)
+            parts.append(self.payload)
+            payload = b"".join(parts)
+        elif wire_format == WIRE_BINARY:
+            header = HEADER.pack(WIRE_VERSION, ROUTED_PUB, 0, 0, 0, self.sender_id, self.pub_id.origin_id, self.pub_id.seqn)
+            payload = header + self.payload
+        else:
+            payload = pickle.dumps(self)
 
         return topic, payload
 
-def deserialize(mqtt_msg: mqtt.MQTTMessage) -> Tuple[str, object]:
-    topic:str = mqtt_msg.topic
-    if topic.startswith(SUB_LOGS_TOPIC_LEVEL):
-        fed_topic = mqtt_msg.payload.decode('utf-8').split(' ')[-1] ## Get last element (topic)
-        if  fnmatch.fnmatch(fed_topic, SUB_LOGS) or \
-            fnmatch.fnmatch(fed_topic, ROUTING_TOPICS) or \
-            fnmatch.fnmatch(fed_topic, MEMB_ANNS) or \
-            fnmatch.fnmatch(fed_topic, FEDERATED_TOPICS) or \
-            fnmatch.fnmatch(fed_topic, CORE_ANNS):
-            
+# Subscriptions of the federators themselves, never federated
+MANAGEMENT_FILTERS = frozenset((SUB_LOGS, ROUTING_TOPICS, MEMB_ANNS, FEDERATED_TOPICS, CORE_ANNS, BATCHES, PRUNES, UNSUB_LOGS, NOTICE_LOGS))
+
+CLASSIFIER = TopicClassifier(default_kind=FEDERATED_PUB)
+CLASSIFIER.add_topic(SUB_LOGS_TOPIC_LEVEL, SUB_LOG)
+CLASSIFIER.add_topic(UNSUB_LOGS_TOPIC_LEVEL, UNSUB_LOG)
+CLASSIFIER.add_topic(NOTICE_LOGS_TOPIC_LEVEL, NOTICE_LOG)
+CLASSIFIER.add_prefix(PRUNE_TOPIC_LEVEL, PRUNE)
+CLASSIFIER.add_prefix(CORE_ANN_TOPIC_LEVEL, CORE_ANN)
+CLASSIFIER.add_prefix(MEMB_ANN_TOPIC_LEVEL, MEMB_ANN)
+CLASSIFIER.add_prefix(ROUTING_TOPICS_LEVEL, ROUTED_PUB)
+CLASSIFIER.add_prefix(BATCH_TOPIC_LEVEL, BATCH)
+CLASSIFIER.add_prefix(CONTROL_BATCH_TOPIC_LEVEL, CONTROL_BATCH)
+
+# Mesh and subscription management, handled ahead of publications when prioritised
+CONTROL_KINDS = frozenset((SUB_LOG, UNSUB_LOG, NOTICE_LOG, CORE_ANN, MEMB_ANN, PRUNE, CONTROL_BATCH))
+CONTROL_TYPES = (SubLog, UnsubLog, CoreAnn, MeshMembAnn, MeshPrune, Tick)
+
+
+def is_control_topic(topic: str) -> bool:
+    return CLASSIFIER.match(topic)[0] in CONTROL_KINDS
+
+
+def is_control(msg) -> bool:
+    return isinstance(msg, CONTROL_TYPES)
+
+
+def opens_topic(msg) -> bool:
+    """Whether msg creates the worker of a topic that has none.
+
+    Core withdrawals do too, the worker must remember the withdrawal when
+    the core's CoreAnns arrive after it.
+    """
+    return isinstance(msg, (SubLog, CoreAnn)) or (isinstance(msg, MeshPrune) and msg.sender_id == msg.core_id)
+
+
+def classify(topic: str, payload: bytes) -> Tuple[int, str]:
+    """Returns the message kind and federated topic without decoding the payload.
+
+    The federated topic is None when the message must be dropped. For
+    connection notices it is the id of the client instead.
+    """
+    kind, start = CLASSIFIER.match(topic)
+
+    if kind == SUB_LOG or kind == UNSUB_LOG:
+        fed_topic = payload.rpartition(b' ')[2].decode('utf-8') ## Get last element (topic)
+        if fed_topic in MANAGEMENT_FILTERS or CLASSIFIER.match(fed_topic)[0] != FEDERATED_PUB:
             logger.debug("SubLog Received in management topic - Droping Message...")
-            return None, None
-        else:
-            payload = mqtt_msg.payload.decode('utf-8')
-            sub_log = SubLog(
-                payload
-            )
-            return fed_topic, sub_log
-        
-    elif topic.startswith(CORE_ANN_TOPIC_LEVEL):
-        fed_topic = topic[len(CORE_ANN_TOPIC_LEVEL):]
-        assert fed_topic, "Empty federated topic"
-        core_ann = pickle.loads(mqtt_msg.payload)
-        return fed_topic, core_ann
-    
-    elif topic.startswith(MEMB_ANN_TOPIC_LEVEL):
-        fed_topic = topic[len(MEMB_ANN_TOPIC_LEVEL):]
-        assert fed_topic, "Empty federated topic"
-        memb_ann = pickle.loads(mqtt_msg.payload)
-        return fed_topic, memb_ann
-    
-    elif topic.startswith(ROUTING_TOPICS_LEVEL):
-        fed_topic = topic[len(ROUTING_TOPICS_LEVEL):]
-        assert fed_topic, "Empty federated topic"
-        routed_pub = pickle.loads(mqtt_msg.payload)
-        return fed_topic, routed_pub
-    
-    # Federated Publications will ever be last match "#"
-    elif topic.startswith(FEDERATED_TOPICS_LEVEL):
-        fed_topic = topic[len(FEDERATED_TOPICS_LEVEL):]
-        assert fed_topic, "Empty federated topic"
-        payload = mqtt_msg.payload
-        federated_pub = FederatedPub(
-            payload
-        )
-        return fed_topic, federated_pub
+            return kind, None
+        return kind, fed_topic
+
+    if kind == NOTICE_LOG:
+        notice = parse_notice(payload)
+        return NOTICE_LOG, notice.client_id if notice is not None else None
+
+    fed_topic = topic[start:]
+    if not fed_topic:
+        raise ValueError(f"Empty federated topic in {topic}")
+    if kind != FEDERATED_PUB:
+        fed_topic = unescape_filter(fed_topic)
 
+    return kind, fed_topic
+
+
+def parse_notice(payload: bytes) -> Optional[ClientNotice]:
+    """Connection or disconnection of a client, None for the other notices."""
+    text = log_text(payload)
+    match = DISCONNECTED.match(text)
+    if match is not None:
+        return ClientNotice(match.group(1), connected=False)
+    match = CONNECTED.match(text)
+    if match is not None:
+        return ClientNotice(match.group(1), connected=True, persistent=match.group(2) == '0')
+    return None
+
+
+def decode(kind: int, payload: bytes) -> object:
+    if kind == SUB_LOG:
+        return SubLog(payload.decode('utf-8'))
+    elif kind == UNSUB_LOG:
+        return UnsubLog(payload.decode('utf-8'))
+    elif kind == NOTICE_LOG:
+        return parse_notice(payload)
+    elif kind == FEDERATED_PUB:
+        return FederatedPub(payload)
     else:
-        raise ValueError(f"Received a packet from a topic it was not supposed to be subscribed to {topic}")
+        return decode_frame(kind, payload)
+
+
+def decode_frame(kind: int, payload: bytes) -> object:
+    """Decodes a CoreAnn, MeshMembAnn, MeshPrune or RoutedPub frame in either wire format."""
+    if not payload:
+        raise ValueError("Empty frame")
+
+    version = payload[0]
+    known_flags = FRAME_FLAGS.get(version)
+    if known_flags is not None:
+        _, frame_kind, flags, core_id, dist, sender_id, origin_id, seqn = HEADER.unpack_from(payload)
+        if frame_kind != kind:
+            raise ValueError(f"Frame of kind {frame_kind} received on a topic of kind {kind}")
+        if flags & ~known_flags:
+            raise ValueError(f"Unknown wire format flags {flags:#04x} in a version {version} frame")
+
+        if kind == CORE_ANN:
+            return CoreAnn(core_id=core_id, dist=dist, sender_id=sender_id, seqn=seqn)
+        elif kind == MEMB_ANN:
+            return MeshMembAnn(core_id=core_id, sender_id=sender_id)
+        elif kind == PRUNE:
+            return MeshPrune(core_id=core_id, sender_id=sender_id, seqn=seqn)
+        elif kind == ROUTED_PUB:
+            start = HEADER.size
+            topic = None
+            if flags & FLAG_TOPIC:
+                topic_len, = TOPIC_LEN.unpack_from(payload, start)
+                start += TOPIC_LEN.size
+                topic = str(memoryview(payload)[start:start + topic_len], 'utf-8')
+                start += topic_len
+            trace = None
+            if flags & FLAG_TRACE:
+                origin, hop_count = TRACE.unpack_from(payload, start)
+                start += TRACE.size
+                trace = (origin, tuple(HOP.iter_unpack(memoryview(payload)[start:start + hop_count * HOP.size])))
+                start += hop_count * HOP.size
+            return RoutedPub(
+                pub_id=PubId(origin_id=origin_id, seqn=seqn),
+                sender_id=sender_id,
+                payload=memoryview(payload)[start:],
+                frame=payload,
+                topic=topic,
+                trace=trace
+            )
+        raise ValueError(f"No binary frame for message kind {kind}")
+
+    elif version == PICKLE_PROTO:
+        if not accept_pickle:
+            raise ValueError("Pickled frame received but legacy wire format is disabled")
+        return pickle.loads(payload)
+
+    raise ValueError(f"Unknown wire format version {version}")
+
+
+def deserialize(mqtt_msg: mqtt.MQTTMessage) -> Tuple[str, object]:
+    kind, fed_topic = classify(mqtt_msg.topic, mqtt_msg.payload)
+    if fed_topic is None:
+        return None, None
+
+    return fed_topic, decode(kind, mqtt_msg.payload)
@@ -0,0 +1,267 @@
+import asyncio
+import bisect
+import logging
+from typing import Dict, List, Set, Tuple
+from message import SUB_LOG, CORE_ANN, MEMB_ANN, ROUTED_PUB, FEDERATED_PUB, BATCH, UNSUB_LOG, NOTICE_LOG, PRUNE, CONTROL_BATCH
+
+KIND_NAMES = {
+    SUB_LOG: "sub_log",
+    CORE_ANN: "core_ann",
+    MEMB_ANN: "memb_ann",
+    ROUTED_PUB: "routed_pub",
+    FEDERATED_PUB: "federated_pub",
+    BATCH: "batch",
+    UNSUB_LOG: "unsub_log",
+    NOTICE_LOG: "notice_log",
+    PRUNE: "prune",
+    CONTROL_BATCH: "control_batch",
+}
+
+# Handler latency buckets, in seconds
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+# Traced publications: delivery latency buckets in seconds, and hop counts
+TRACE_BUCKETS = (5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HOP_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 24, 32)
+# Traced topics beyond the tracked ones are reported together
+OTHER_TOPICS = "_other"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # One count per bucket, the last one for values above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            buckets.append((repr(bound), total))
+        buckets.append(("+Inf", total + self.counts[-1]))
+        return buckets
+
+
+class TopK:
+    """Approximate counts of the busiest keys in bounded memory (Space-Saving).
+
+    Up to capacity keys are counted. A new key replaces one with the lowest
+    count and inherits it, so a key's count is never underestimated and any
+    key seen more than total / capacity times is tracked. Keys are kept in
+    buckets by count with the lowest count known, so an update is O(1)
+    however many keys are tracked.
+    """
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        # count -> keys with that count
+        self.buckets: Dict[int, Set[str]] = {}
+        self.min = 0
+
+    def add(self, key: str) -> None:
+        counts = self.counts
+        buckets = self.buckets
+        count = counts.get(key)
+        if count is None:
+            if len(counts) < self.capacity:
+                count = 0
+            else:
+                count = self.min
+                del counts[buckets[count].pop()]
+        else:
+            buckets[count].discard(key)
+
+        if count and not buckets[count]:
+            del buckets[count]
+        if count == 0 or (count == self.min and count not in buckets):
+            self.min = count + 1
+
+        counts[key] = count + 1
+        bucket = buckets.get(count + 1)
+        if bucket is None:
+            bucket = buckets[count + 1] = set()
+        bucket.add(key)
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class Metrics:
+    """Counters and histograms updated by the federator as it goes.
+
+    Only cheap updates happen on the message path; queue depths and the
+    counters kept by other components are read when the endpoint is scraped.
+    """
+    def __init__(self, top_k: int) -> None:
+        self.top_k = top_k
+        self.received = [0] * len(KIND_NAMES)
+        # Over-provisioned so the reported top_k are accurate
+        self.topics = TopK(top_k * 4)
+        self.latency: Dict[str, Histogram] = {}
+        self.dedup_lookups = 0
+        self.dedup_hits = 0
+        # Traced publications, by mesh topic and by hop between two brokers
+        self.trace_latency: Dict[str, Histogram] = {}
+        self.trace_hops: Dict[str, Histogram] = {}
+        self.hop_latency: Dict[Tuple[int, int], Histogram] = {}
+
+    def handled(self, msg, elapsed: float) -> None:
+        name = type(msg).__name__
+        histogram = self.latency.get(name)
+        if histogram is None:
+            histogram = self.latency[name] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(elapsed)
+
+    def traced(self, topic: str, origin_id: int, trace: tuple, receiver_id: int, now: int) -> None:
+        """Records a traced publication delivered by receiver_id, times in microseconds."""
+        origin, hops = trace
+        if topic not in self.trace_latency and len(self.trace_latency) >= self.topics.capacity:
+            topic = OTHER_TOPICS
+        latency = self.trace_latency.get(topic)
+        if latency is None:
+            latency = self.trace_latency[topic] = Histogram(TRACE_BUCKETS)
+            self.trace_hops[topic] = Histogram(HOP_BUCKETS)
+        latency.observe(max(now - origin, 0) / 1e6)
+        self.trace_hops[topic].observe(len(hops) + 1)
+
+        # Each hop from the time the previous broker forwarded it
+        previous, at = origin_id, 0
+        for broker, elapsed in hops + ((receiver_id, now - origin),):
+            histogram = self.hop_latency.get((previous, broker))
+            if histogram is None:
+                histogram = self.hop_latency[(previous, broker)] = Histogram(TRACE_BUCKETS)
+            histogram.observe(max(elapsed - at, 0) / 1e6)
+            previous, at = broker, elapsed
+
+
+def label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exposition(federator) -> str:
+    """Prometheus text exposition of the federator's metrics."""
+    from federator import Federator
+    federator: Federator = federator
+    ctx = federator.ctx
+    metrics: Metrics = ctx.metrics
+    lines = []
+
+    def family(name: str, kind: str, help: str) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    family("federator_received_total", "counter", "Messages received, by kind (batch entries counted one by one).")
+    for kind, name in KIND_NAMES.items():
+        lines.append(f'federator_received_total{{kind="{name}"}} {metrics.received[kind]}')
+
+    family("federator_topic_messages_total", "counter", f"Messages routed to the {metrics.top_k} busiest federated topics (approximate).")
+    for topic, count in metrics.topics.top(metrics.top_k):
+        lines.append(f'federator_topic_messages_total{{topic="{label(topic)}"}} {count}')
+
+    def histogram(name: str, labels: str, values: Histogram) -> None:
+        for bound, count in values.cumulative():
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {values.sum}')
+        lines.append(f'{name}_count{{{labels}}} {sum(values.counts)}')
+
+    family("federator_handler_seconds", "histogram", "Time topic workers spent handling a message, by message type.")
+    for name, latency in metrics.latency.items():
+        histogram("federator_handler_seconds", f'type="{name}"', latency)
+
+    if metrics.trace_latency:
+        family("federator_trace_latency_seconds", "histogram", "Origin to delivery latency of traced publications, by mesh topic.")
+        for topic, latency in metrics.trace_latency.items():
+            histogram("federator_trace_latency_seconds", f'topic="{label(topic)}"', latency)
+        family("federator_trace_hops", "histogram", "Links traced publications went over until delivered, by mesh topic.")
+        for topic, hops in metrics.trace_hops.items():
+            histogram("federator_trace_hops", f'topic="{label(topic)}"', hops)
+        family("federator_trace_hop_seconds", "histogram", "Time traced publications took from a broker to the next one.")
+        for (sender, receiver), latency in metrics.hop_latency.items():
+            histogram("federator_trace_hop_seconds", f'from="{sender}",to="{receiver}"', latency)
+
+    family("federator_dedup_lookups_total", "counter", "RoutedPub ids checked against the dedup windows.")
+    lines.append(f"federator_dedup_lookups_total {metrics.dedup_lookups}")
+    family("federator_dedup_hits_total", "counter", "RoutedPubs dropped as duplicates.")
+    lines.append(f"federator_dedup_hits_total {metrics.dedup_hits}")
+    if ctx.dedup is not None:
+        family("federator_dedup_evictions_total", "counter", "Dedup windows evicted from the shared store.")
+        lines.append(f"federator_dedup_evictions_total {ctx.dedup.evictions}")
+        family("federator_dedup_bytes", "gauge", "Estimated size of the shared dedup store.")
+        lines.append(f"federator_dedup_bytes {ctx.dedup.used}")
+
+    family("federator_ingress_depth", "gauge", "Inbound messages waiting for the dispatcher.")
+    lines.append(f"federator_ingress_depth {federator.ingress.qsize()}")
+
+    if federator.pool is not None:
+        depths = [lane.qsize() for lane in federator.pool.lanes]
+        topics = len(federator.pool.table)
+    else:
+        depths = [worker.get_queue().qsize() for worker in federator.workers.values()]
+        topics = len(federator.workers)
+    family("federator_workers", "gauge", "Topics with routing state, by state.")
+    lines.append(f'federator_workers{{state="active"}} {topics}')
+    lines.append(f'federator_workers{{state="hibernated"}} {len(federator.hibernated)}')
+    family("federator_worker_queue_depth", "gauge", "Messages waiting in topic worker queues (pool lanes with the pool engine).")
+    lines.append(f'federator_worker_queue_depth{{stat="sum"}} {sum(depths)}')
+    lines.append(f'federator_worker_queue_depth{{stat="max"}} {max(depths, default=0)}')
+
+    family("federator_neighbor_sent_total", "counter", "Publishes handed to the client of a neighbor.")
+    lines.extend(f'federator_neighbor_sent_total{{neighbor="{id}"}} {channel.sent}' for id, channel in ctx.neighbors.items())
+    family("federator_neighbor_failed_total", "counter", "Publishes refused by the client of a neighbor.")
+    lines.extend(f'federator_neighbor_failed_total{{neighbor="{id}"}} {channel.failed}' for id, channel in ctx.neighbors.items())
+    family("federator_neighbor_dropped_total", "counter", "Publications dropped by the overflow policy of a neighbor link.")
+    lines.extend(f'federator_neighbor_dropped_total{{neighbor="{id}"}} {channel.dropped}' for id, channel in ctx.neighbors.items())
+    family("federator_neighbor_queue_depth", "gauge", "Messages waiting to be sent to a neighbor.")
+    lines.extend(f'federator_neighbor_queue_depth{{neighbor="{id}"}} {channel.depth()}' for id, channel in ctx.neighbors.items())
+    family("federator_neighbor_queued_bytes", "gauge", "Publication bytes waiting to be sent to a neighbor.")
+    lines.extend(f'federator_neighbor_queued_bytes{{neighbor="{id}"}} {channel.queued_bytes}' for id, channel in ctx.neighbors.items())
+    family("federator_neighbor_inflight", "gauge", "Publishes to a neighbor not acknowledged yet.")
+    lines.extend(f'federator_neighbor_inflight{{neighbor="{id}"}} {len(channel.inflight)}' for id, channel in ctx.neighbors.items())
+
+    if ctx.control_batchers is not None:
+        family("federator_control_coalesced_total", "counter", "Announcements replaced by a newer one before leaving.")
+        lines.extend(f'federator_control_coalesced_total{{neighbor="{id}"}} {batcher.coalesced}' for id, batcher in ctx.control_batchers.items())
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+async def serve_metrics(federator, port: int) -> None:
+    """Serves the metrics over HTTP on the event loop, whatever the request path."""
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # Request line and headers, the request itself does not matter
+            while (await reader.readline()).strip():
+                pass
+            body = exposition(federator).encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii')
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(respond, port=port)
+    logger.info(f"Serving metrics on port {port}")
+    async with server:
+        await server.serve_forever()
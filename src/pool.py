@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import time
+from typing import Dict
+from worker import TopicWorker, YIELD_EVERY
+from message import is_control
+from ingress import PriorityLanes
+
+ENGINE_TASKS = "tasks"
+ENGINE_POOL = "pool"
+ENGINES = (ENGINE_TASKS, ENGINE_POOL)
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def is_control_entry(entry) -> bool:
+    return is_control(entry[1])
+
+
+class WorkerPool:
+    """Fixed set of consumer coroutines over one table of per-topic state.
+
+    Instead of a task and a queue per federated topic, each topic is pinned by
+    hash to one of size lanes. A lane handles its messages one at a time, so
+    messages of a topic keep their order, while the only per-topic cost is its
+    TopicWorker record in the table.
+    """
+    def __init__(self, ctx, size: int) -> None:
+        from federator import Context
+        self.ctx: Context = ctx
+        self.size = size
+        if ctx.control_priority:
+            self.lanes = [PriorityLanes(is_control_entry) for _ in range(size)]
+        else:
+            self.lanes = [asyncio.Queue() for _ in range(size)]
+        self.table: Dict[str, TopicWorker] = {}
+        self.consumers = []
+
+    def start(self) -> None:
+        self.consumers = [asyncio.create_task(self.consume(lane)) for lane in self.lanes]
+        logger.info(f"Started worker pool with {self.size} consumers")
+
+    def route(self, federated_topic: str, msg, create: bool) -> bool:
+        """Queues msg for its topic, creating the topic state if allowed. False if dropped."""
+        if federated_topic not in self.table:
+            if not create:
+                return False
+            # The worker shares the pool's context and owns no queue or task
+            self.table[federated_topic] = TopicWorker(federated_topic, self.ctx, None)
+
+        self.lanes[hash(federated_topic) % self.size].put_nowait((federated_topic, msg))
+        return True
+
+    def restore(self, federated_topic: str, state: tuple) -> None:
+        worker = TopicWorker(federated_topic, self.ctx, None)
+        worker.restore(state)
+        self.table[federated_topic] = worker
+
+    async def consume(self, lane: asyncio.Queue) -> None:
+        metrics = self.ctx.metrics
+        handled = 0
+        while True:
+            federated_topic, msg = await lane.get()
+            try:
+                if metrics is None:
+                    await self.table[federated_topic].handle(msg)
+                else:
+                    start = time.perf_counter()
+                    await self.table[federated_topic].handle(msg)
+                    metrics.handled(msg, time.perf_counter() - start)
+            except Exception as e:
+                logger.error(f"WORKER[{federated_topic}]: {e}")
+
+            handled += 1
+            if handled % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
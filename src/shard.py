@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import threading
+import zlib
+import multiprocessing as mp
+from typing import List
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from conf import FederatorConfig, core_timeout
+from federator import Context, Federator, start_clients, subscribe_host, create_neighbors_channels, create_batchers, create_dedup_store, is_control_mqtt
+from federator import create_control_batchers, create_timers
+from channel import report_links
+from dedup import maintain_store
+from metrics import Metrics, serve_metrics
+from capture import open_capture, flush_capture
+from pool import ENGINE_POOL
+from ingress import Ingress
+from message import classify, decode, set_wire_format, is_control_topic, FEDERATED_PUB, SUB_LOG, UNSUB_LOG, NOTICE_LOG, CORE_ANN, BATCH, CONTROL_BATCH, CONTROL_KINDS
+from filters import FilterIndex
+from batch import classify_entries
+from interest import HostInterest, is_own_sub_log, SUBSCRIBE_INTEREST
+import snapshot
+
+# User property set on host deliveries made by shard processes. Their clients
+# are not the subscribed host client, so noLocal does not filter them out and
+# the dispatcher must drop them itself instead of routing them again.
+SHARD_MARKER = "federator-shard"
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def shard_of(federated_topic: str, shards: int) -> int:
+    # crc32 rather than hash(): string hashing is salted per process
+    return zlib.crc32(federated_topic.encode('utf-8')) % shards
+
+
+def marker_properties(shard: int) -> Properties:
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.UserProperty = (SHARD_MARKER, str(shard))
+    return properties
+
+
+def is_marked(mqtt_msg: mqtt.MQTTMessage) -> bool:
+    properties = getattr(mqtt_msg, 'properties', None)
+    user_properties = getattr(properties, 'UserProperty', None)
+    if not user_properties:
+        return False
+    return any(key == SHARD_MARKER for key, _ in user_properties)
+
+
+class ShardDispatcher:
+    """Classifies host traffic and hands each federated topic to its shard process.
+
+    All messages of a topic go through the same queue, so per-topic ordering is
+    the order in which the host broker delivered them.
+    """
+    def __init__(self, id: int, host_client: mqtt.Client, ingress: Ingress, queues: List, interest: bool = False, priority: bool = False, snapshot_path: str = "") -> None:
+        self.id = id
+        self.host_client = host_client
+        self.ingress = ingress
+        self.queues = queues
+        self.interest = interest
+        self.priority = priority
+        # Filters with a mesh, a publication goes to the shards owning the ones it matches
+        self.subscriptions = FilterIndex()
+        self.snapshot_path = snapshot_path
+
+    def load_snapshots(self, shards: int) -> None:
+        """Learns the filters the shards restore from their snapshots."""
+        for index in range(shards):
+            for topic in snapshot.load(f"{self.snapshot_path}.{index}"):
+                self.subscriptions.add(topic)
+
+    async def run(self):
+        subscribe_host(self.host_client, self.interest)
+        shards = len(self.queues)
+        if self.snapshot_path:
+            self.load_snapshots(shards)
+
+        while True:
+            batch = await self.ingress.get_batch()
+            routed = [[] for _ in range(shards)]
+            for mqtt_msg in batch:
+                try:
+                    kind, federated_topic = classify(mqtt_msg.topic, mqtt_msg.payload)
+                except Exception as e:
+                    logger.error(e)
+                    continue
+
+                if federated_topic is None:
+                    continue
+                if kind == FEDERATED_PUB and is_marked(mqtt_msg):
+                    continue
+                if (kind == SUB_LOG or kind == UNSUB_LOG) and is_own_sub_log(mqtt_msg.payload, self.id):
+                    continue
+                if kind == NOTICE_LOG:
+                    # Any shard may hold subscriptions of the client
+                    for items in routed:
+                        items.append((kind, federated_topic, mqtt_msg.payload))
+                    continue
+
+                if kind == BATCH or kind == CONTROL_BATCH:
+                    # Entries of one batch may belong to different shards
+                    try:
+                        for kind, federated_topic, payload in classify_entries(mqtt_msg.payload):
+                            if kind == CORE_ANN:
+                                self.subscriptions.add(federated_topic)
+                            routed[shard_of(federated_topic, shards)].append((kind, federated_topic, bytes(payload)))
+                    except Exception as e:
+                        logger.error(e)
+                    continue
+
+                if kind == FEDERATED_PUB:
+                    targets = {shard_of(topic_filter, shards) for topic_filter in self.subscriptions.match(federated_topic)}
+                    for shard in targets:
+                        routed[shard].append((kind, federated_topic, mqtt_msg.payload))
+                    continue
+                if kind == SUB_LOG or kind == CORE_ANN:
+                    self.subscriptions.add(federated_topic)
+
+                routed[shard_of(federated_topic, shards)].append((kind, federated_topic, mqtt_msg.payload))
+
+            # One pickled batch per shard instead of one item per message
+            for queue, items in zip(self.queues, routed):
+                if self.priority:
+                    # Control items in a batch of their own, the shard ingress takes it first
+                    control = [item for item in items if item[0] in CONTROL_KINDS]
+                    if control:
+                        queue.put(control)
+                        items = [item for item in items if item[0] not in CONTROL_KINDS]
+                if items:
+                    queue.put(items)
+
+
+class ShardFederator(Federator):
+    """Federator of a shard process, fed with messages already classified by the dispatcher.
+
+    With interest subscriptions the shard host client subscribes to the topics
+    it owns and its publications arrive here directly as MQTT messages.
+    """
+    async def run(self):
+        self.start_engine()
+
+        while True:
+            batch = await self.ingress.get_batch()
+            for items in batch:
+                if not isinstance(items, list):
+                    if not is_marked(items):
+                        await self.dispatch(items)
+                    continue
+
+                for kind, federated_topic, payload in items:
+                    if self.ctx.metrics is not None:
+                        self.ctx.metrics.received[kind] += 1
+                    try:
+                        msg = decode(kind, payload)
+                    except Exception as e:
+                        logger.error(e)
+                        continue
+                    self.deliver(kind, federated_topic, msg)
+
+
+def is_control_item(items) -> bool:
+    # Batches from the dispatcher, or MQTT messages with interest subscriptions
+    if isinstance(items, list):
+        return bool(items) and items[0][0] in CONTROL_KINDS
+    return is_control_topic(items.topic)
+
+
+def pump(queue, ingress: Ingress) -> None:
+    while True:
+        items = queue.get()
+        if items is None:
+            # The dispatcher is shutting down: stop the loop so the shard
+            # writes its snapshot and closes like on an interrupt
+            ingress.loop.call_soon_threadsafe(ingress.loop.stop)
+            break
+        ingress.put(items)
+
+
+def shard_main(index: int, config: FederatorConfig, queue) -> None:
+    logger.info(f"Starting federator shard {index}...")
+
+    set_wire_format(config.wire_format, config.accept_pickle)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    ingress = Ingress(loop, is_control_item if config.control_priority else None)
+
+    # The dispatcher subscribes to the management topics, shards only to
+    # the federated topics they own when using interest subscriptions
+    interest = config.host_subscriptions == SUBSCRIBE_INTEREST
+    on_message = None
+    capture = None
+    if interest:
+        capture = open_capture(f"{config.capture_path}.{index}", config.host.id) if config.capture_path else None
+        on_message = capture.tap(ingress.on_message) if capture is not None else ingress.on_message
+    host_client, neighbors_clients, helpers = start_clients(loop, config, on_message, shard=index)
+
+    neighbors = create_neighbors_channels(loop, config, neighbors_clients)
+
+    ctx = Context(
+        id=config.host.id,
+        redundancy=config.redundancy,
+        cache_size=config.cache_size,
+        neighbors=neighbors,
+        host_client=host_client,
+        host_properties=marker_properties(index),
+        interest=HostInterest(host_client, interest),
+        batchers=create_batchers(config, neighbors),
+        # Each shard gets an equal part of the budget
+        dedup=create_dedup_store(config, config.shards),
+        control_priority=config.control_priority,
+        control_batchers=create_control_batchers(config, neighbors),
+        timers=create_timers(config),
+        core_refresh=config.core_refresh_ms / 1000,
+        core_timeout=core_timeout(config),
+        metrics=Metrics(config.metrics_top_k) if config.metrics_port else None,
+        trace_sample=config.trace_sample
+    )
+
+    federator = ShardFederator(
+        ctx=ctx,
+        ingress=ingress,
+        idle_ttl=config.worker_idle_ttl,
+        pool_size=config.pool_size if config.engine == ENGINE_POOL else 0,
+        snapshot_path=f"{config.snapshot_path}.{index}" if config.snapshot_path else "",
+        snapshot_interval=config.snapshot_interval,
+        capture=capture,
+        helpers=helpers
+    )
+
+    threading.Thread(target=pump, args=(queue, ingress), daemon=True).start()
+
+    loop.create_task(federator.run())
+
+    loop.create_task(report_links(neighbors))
+
+    if ctx.dedup is not None:
+        loop.create_task(maintain_store(ctx.dedup))
+
+    if ctx.metrics is not None:
+        loop.create_task(serve_metrics(federator, config.metrics_port + index))
+
+    if capture is not None:
+        loop.create_task(flush_capture(capture))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+    if federator.snapshot_path:
+        federator.write_snapshot()
+
+    if capture is not None:
+        capture.close()
+
+    for helper in helpers:
+        helper.close()
+
+    loop.close()
+
+
+def run(config: FederatorConfig) -> None:
+    logger.info(f"Starting sharded federator with {config.shards} shards...")
+
+    # spawn: shards must not inherit the dispatcher's loop or paho threads
+    mp_ctx = mp.get_context("spawn")
+    queues = [mp_ctx.Queue() for _ in range(config.shards)]
+    processes = [
+        mp_ctx.Process(target=shard_main, args=(index, config, queue), name=f"federator-shard-{index}", daemon=True)
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    ingress = Ingress(loop, is_control_mqtt if config.control_priority else None)
+
+    # Shards with interest subscriptions capture what their own clients receive
+    capture = open_capture(config.capture_path, config.host.id) if config.capture_path else None
+    on_message = capture.tap(ingress.on_message) if capture is not None else ingress.on_message
+
+    host_client, _, helpers = start_clients(loop, config, on_message, with_neighbors=False)
+
+    dispatcher = ShardDispatcher(config.host.id, host_client, ingress, queues, config.host_subscriptions == SUBSCRIBE_INTEREST, config.control_priority, config.snapshot_path)
+
+    loop.create_task(dispatcher.run())
+
+    if capture is not None:
+        loop.create_task(flush_capture(capture))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=5)
+        if capture is not None:
+            capture.close()
+        for helper in helpers:
+            helper.close()
+
+    loop.close()
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import struct
+from typing import Dict, Iterable, List, Tuple
+from dedup import first_seqn
+
+# File: magic, then one record per topic. Record: topic length, record
+# length, topic, then the state: flags, core id, dist, next seqn, parent
+# count, child count, parents and children ids; then the local subscribers:
+# count, and for each one flags, client id length, client id.
+MAGIC = b"FEDSNAP2"
+RECORD = struct.Struct("!HI")
+STATE = struct.Struct("!BIHQBH")
+ID = struct.Struct("!I")
+COUNT = struct.Struct("!H")
+CLIENT = struct.Struct("!BH")
+
+# Version 1: record length on 16 bits, no local subscribers
+MAGIC_V1 = b"FEDSNAP1"
+RECORD_V1 = struct.Struct("!HH")
+
+HAS_CORE = 0x01
+IS_CORE = 0x02
+LOCAL_SUBS = 0x04
+
+# Client flag: its subscriptions outlive its connection
+PERSISTENT = 0x01
+
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def encode_state(state: tuple, own_id: int) -> bytes:
+    core_id, dist, parents, children, has_local_subs, next_id = state
+    flags = LOCAL_SUBS if has_local_subs else 0
+    if core_id is not None:
+        flags |= HAS_CORE
+        if core_id == own_id:
+            flags |= IS_CORE
+    parts = [STATE.pack(flags, core_id or 0, dist, next_id, len(parents), len(children))]
+    parts.extend(ID.pack(id) for id in parents)
+    parts.extend(ID.pack(id) for id in children)
+    return b"".join(parts)
+
+
+def decode_state(record) -> tuple:
+    """The hibernation state (see TopicWorker.hibernate()) of a snapshot record."""
+    flags, core_id, dist, next_id, n_parents, n_children = STATE.unpack_from(record)
+    ids = [ID.unpack_from(record, STATE.size + i * ID.size)[0] for i in range(n_parents + n_children)]
+    return (
+        core_id if flags & HAS_CORE else None,
+        dist,
+        tuple(ids[:n_parents]),
+        tuple(ids[n_parents:]),
+        bool(flags & LOCAL_SUBS),
+        # Ids handed out after the snapshot was written must not be reused
+        max(next_id, first_seqn())
+    )
+
+
+def state_size(record) -> int:
+    n_parents, n_children = STATE.unpack_from(record)[4:]
+    return STATE.size + (n_parents + n_children) * ID.size
+
+
+def encode_clients(clients: Iterable[str], persistent: set) -> bytes:
+    clients = list(clients)
+    parts = [COUNT.pack(len(clients))]
+    for client_id in clients:
+        encoded = client_id.encode('utf-8')
+        parts.append(CLIENT.pack(PERSISTENT if client_id in persistent else 0, len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+
+def decode_clients(data) -> List[Tuple[str, bool]]:
+    """(client id, persistent) of the local subscribers section of a record."""
+    (count,) = COUNT.unpack_from(data)
+    offset = COUNT.size
+    clients = []
+    for _ in range(count):
+        flags, length = CLIENT.unpack_from(data, offset)
+        offset += CLIENT.size
+        clients.append((str(data[offset:offset + length], 'utf-8'), bool(flags & PERSISTENT)))
+        offset += length
+    return clients
+
+
+def has_mesh(record) -> bool:
+    return bool(record[0] & HAS_CORE)
+
+
+def is_own_core(record) -> bool:
+    return bool(record[0] & IS_CORE)
+
+
+def encode(states: Iterable[Tuple[str, object]], own_id: int, subscriptions) -> bytes:
+    """Snapshot of (topic, state) pairs and of the local subscribers in subscriptions (a FilterIndex).
+
+    States still undecoded from a previous load are kept as is.
+    """
+    parts = [MAGIC]
+    for topic, state in states:
+        record = encode_state(state, own_id) if isinstance(state, tuple) else bytes(state)
+        record += encode_clients(subscriptions.local.get(topic, ()), subscriptions.persistent)
+        encoded_topic = topic.encode('utf-8')
+        parts.append(RECORD.pack(len(encoded_topic), len(record)))
+        parts.append(encoded_topic)
+        parts.append(record)
+    return b"".join(parts)
+
+
+def write(path: str, data: bytes) -> None:
+    # Replace the previous snapshot only once the new one is complete
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+def read_record(record, v1: bool = False):
+    """(state, local subscribers) of a record, None if it does not decode.
+
+    States are decoded on first use, long after loading: their length is
+    checked here so that decode_state() cannot fail then.
+    """
+    try:
+        size = state_size(record)
+        if len(record) < size or (v1 and len(record) != size):
+            return None
+        if v1:
+            return record, []
+        clients = decode_clients(record[size:])
+    except (struct.error, UnicodeDecodeError):
+        return None
+    return record[:size], clients
+
+
+def load(path: str) -> Dict[str, Tuple[memoryview, List[Tuple[str, bool]]]]:
+    """Reads a snapshot into topic -> (undecoded state, local subscribers).
+
+    decode_state() is left to the first use of a topic.
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return {}
+
+    if data.startswith(MAGIC):
+        record_header = RECORD
+    elif data.startswith(MAGIC_V1):
+        record_header = RECORD_V1
+    else:
+        logger.error(f"Ignoring snapshot {path}: unknown format")
+        return {}
+
+    view = memoryview(data)
+    records = {}
+    offset = len(MAGIC)
+    try:
+        while offset < len(view):
+            topic_len, record_len = record_header.unpack_from(view, offset)
+            offset += record_header.size
+            topic = str(view[offset:offset + topic_len], 'utf-8')
+            offset += topic_len
+            record = view[offset:offset + record_len]
+            offset += record_len
+            if len(record) < record_len:
+                raise struct.error(f"record of {topic} cut short")
+            entry = read_record(record, record_header is RECORD_V1)
+            if entry is None:
+                logger.error(f"Snapshot {path}: ignoring the corrupt record of {topic}")
+                continue
+            records[topic] = entry
+    except (struct.error, UnicodeDecodeError) as e:
+        logger.error(f"Ignoring snapshot {path}: {e}")
+        return {}
+
+    return records
+
+
+async def write_snapshots(federator, path: str, interval: float) -> None:
+    """Periodically writes the routing state of every topic of the federator."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        data = encode(federator.states(), federator.ctx.id, federator.ctx.subscriptions)
+        # The file is written off the loop, the state is read on it
+        try:
+            await loop.run_in_executor(None, write, path, data)
+        except OSError as e:
+            logger.error(f"Cannot write snapshot {path}: {e}")
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from typing import Callable
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class TimerWheel:
+    """Hashed timing wheel delivering timer messages to topic workers.
+
+    One loop callback per tick serves every topic: a timer is an entry in the
+    slot its deadline falls in, with the number of full turns left. Timers
+    are not cancellable, workers ignore the ones that no longer apply.
+    """
+    def __init__(self, tick: float, slots: int = 512) -> None:
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0
+        self.loop = None
+        self.fire = None
+
+    def start(self, fire: Callable) -> None:
+        """Starts turning, due timers are passed to fire(topic, msg)."""
+        self.fire = fire
+        self.loop = asyncio.get_running_loop()
+        self.loop.call_later(self.tick, self.advance)
+
+    def schedule(self, delay: float, topic: str, msg) -> None:
+        ticks = max(1, round(delay / self.tick))
+        rounds, offset = divmod(ticks - 1, len(self.slots))
+        self.slots[(self.current + offset + 1) % len(self.slots)].append([rounds, topic, msg])
+
+    def advance(self) -> None:
+        self.loop.call_later(self.tick, self.advance)
+        self.current = (self.current + 1) % len(self.slots)
+
+        due = []
+        pending = []
+        for entry in self.slots[self.current]:
+            if entry[0] == 0:
+                due.append(entry)
+            else:
+                entry[0] -= 1
+                pending.append(entry)
+        self.slots[self.current] = pending
+
+        for _, topic, msg in due:
+            try:
+                self.fire(topic, msg)
+            except Exception as e:
+                logger.error(f"Timer for {topic}: {e}")
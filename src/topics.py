@@ -1,3 +1,5 @@
+import re
+
 CORE_ANNS = "federator/core_ann/#"
 CORE_ANN_TOPIC_LEVEL = "federator/core_ann/"
 
@@ -11,4 +13,36 @@ ROUTING_TOPICS = "federator/routing/#"
 ROUTING_TOPICS_LEVEL = "federator/routing/"
 
 SUB_LOGS = "$SYS/broker/log/M/subscribe/#"
-SUB_LOGS_TOPIC_LEVEL = "$SYS/broker/log/M/subscribe"
\ No newline at end of file
+SUB_LOGS_TOPIC_LEVEL = "$SYS/broker/log/M/subscribe"
+
+BATCHES = "federator/batch/#"
+BATCH_TOPIC_LEVEL = "federator/batch/"
+# Announcement batches, under BATCHES so no other subscription is needed
+CONTROL_BATCH_TOPIC_LEVEL = "federator/batch/control/"
+
+PRUNES = "federator/prune/#"
+PRUNE_TOPIC_LEVEL = "federator/prune/"
+
+UNSUB_LOGS = "$SYS/broker/log/M/unsubscribe/#"
+UNSUB_LOGS_TOPIC_LEVEL = "$SYS/broker/log/M/unsubscribe"
+
+NOTICE_LOGS = "$SYS/broker/log/N"
+NOTICE_LOGS_TOPIC_LEVEL = "$SYS/broker/log/N"
+
+# Wildcard filters are federated too, but a topic name cannot contain
+# wildcards, so they are escaped in the federator topics of their mesh
+ESCAPES = {'%': '%25', '+': '%2B', '#': '%23'}
+UNESCAPES = {code: char for char, code in ESCAPES.items()}
+ESCAPED = re.compile('%(25|2B|23)')
+
+
+def escape_filter(federated_topic: str) -> str:
+    if '+' not in federated_topic and '#' not in federated_topic and '%' not in federated_topic:
+        return federated_topic
+    return ''.join(ESCAPES.get(char, char) for char in federated_topic)
+
+
+def unescape_filter(level: str) -> str:
+    if '%' not in level:
+        return level
+    return ESCAPED.sub(lambda m: UNESCAPES[m.group(0)], level)
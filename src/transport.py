@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import socket
+import paho.mqtt.client as mqtt
+
+TRANSPORT_THREAD = "thread"
+TRANSPORT_ASYNCIO = "asyncio"
+# In-process brokers, see loopback.py
+TRANSPORT_LOOPBACK = "loopback"
+TRANSPORTS = (TRANSPORT_THREAD, TRANSPORT_ASYNCIO, TRANSPORT_LOOPBACK)
+
+MISC_INTERVAL = 1
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 120
+
+logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class AsyncioHelper:
+    """Drives a paho client from an asyncio loop instead of a network thread.
+
+    The client socket is registered with the loop selector, so reads, writes
+    and the keepalive housekeeping all run on the loop thread that also runs
+    the Federator and the topic workers. Must be attached before connect().
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client, name: str) -> None:
+        self.loop = loop
+        self.client = client
+        self.name = name
+        self.misc = None
+        self.closing = False
+
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock) -> None:
+        logger.debug(f"{self.name}: socket opened")
+        self.loop.add_reader(sock, client.loop_read)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048 * 1024)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock) -> None:
+        logger.debug(f"{self.name}: socket closed")
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.misc is not None:
+            self.misc.cancel()
+            self.misc = None
+        if not self.closing:
+            self.loop.create_task(self.reconnect())
+
+    def on_socket_register_write(self, client, userdata, sock) -> None:
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock) -> None:
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self) -> None:
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(MISC_INTERVAL)
+            except asyncio.CancelledError:
+                break
+
+    async def reconnect(self) -> None:
+        delay = RECONNECT_MIN_DELAY
+        while not self.closing:
+            await asyncio.sleep(delay)
+            try:
+                self.client.reconnect()
+                logger.info(f"{self.name}: reconnected")
+                return
+            except OSError as e:
+                logger.error(f"{self.name}: reconnect failed: {e}")
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def close(self) -> None:
+        self.closing = True
+        self.client.disconnect()
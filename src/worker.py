@@ -1,14 +1,20 @@
 import logging
 import asyncio
-from message import SubLog, FederatedPub, CoreAnn, MeshMembAnn, PubId, RoutedPub
+import time
+import random
+from message import SubLog, UnsubLog, FederatedPub, CoreAnn, MeshMembAnn, MeshPrune, PubId, RoutedPub, Tick, MAX_HOPS, is_control
+from ingress import PriorityLanes
 import paho.mqtt.client as mqtt
 from announcer import Announcer
 import copy
-from lru import LRUCache
+from dedup import DedupWindow, first_seqn
 
 HOST_QOS = 2
 NEIGHBORS_QOS = 2
 
+# Messages a worker handles back to back before giving the loop to others
+YIELD_EVERY = 64
+
 logging.basicConfig(
         format='%(asctime)s [%(levelname)s] %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
@@ -18,31 +24,75 @@ logger.setLevel(logging.INFO)
 
 
 class TopicWorkerHandle:
-    def __init__(self, federated_topic: str, ctx) -> asyncio.Queue:
+    def __init__(self, federated_topic: str, ctx, state: tuple = None) -> asyncio.Queue:
         from federator import Context
         self.ctx: Context = ctx
-        self.queue = asyncio.Queue()
+        self.queue = PriorityLanes(is_control) if ctx.control_priority else asyncio.Queue()
         self.worker = TopicWorker(federated_topic, ctx, self.queue)
-        asyncio.create_task(self.worker.start())
+        if state is not None:
+            self.worker.restore(state)
+        self.task = asyncio.create_task(self.worker.start())
 
         logger.info(f"Spawned new worker for topic {federated_topic}")
     
     def get_queue(self):
         return self.queue
 
+    def idle_for(self, now: float) -> float:
+        if self.worker.busy or not self.queue.empty():
+            return 0
+        if self.worker.live is not None and self.worker.current_core == self.ctx.id:
+            # Cores must keep refreshing their mesh
+            return 0
+        return now - self.worker.last_active
+
+    def stop(self) -> tuple:
+        """Stops an idle worker and returns its hibernation state."""
+        self.task.cancel()
+        return self.worker.hibernate()
+
+
+def first_round() -> int:
+    """First refresh round of a broker becoming core.
+
+    Members may still hold rounds of an earlier term of the same core, ahead
+    of a counter starting from 0: the clock is not.
+    """
+    return time.time_ns() // 1_000_000
+
 
 class CoreBroker:
+    __slots__ = ('id', 'dist', 'parents')
+
     def __init__(self, id, dist, parents: list) -> None:
         self.id = id
         self.dist = dist
         self.parents = parents
 
 
+class Liveness:
+    """Soft state of a topic mesh: last refresh round, when neighbors and children were last heard."""
+    __slots__ = ('seqn', 'heard', 'children', 'ticking', 'tick')
+
+    def __init__(self) -> None:
+        self.seqn = 0
+        # Neighbor -> (distance to the core through it, time heard)
+        self.heard = {}
+        # Child -> time of its last membership announcement
+        self.children = {}
+        self.ticking = False
+        # Timer message of this worker only, see Tick
+        self.tick = Tick()
+
+
 # class Parent:
 #     def __init__(self, id) -> None:
 #         self.id = id
 
 class TopicWorker:
+    # Slots keep per-topic state small when a WorkerPool holds many of them
+    __slots__ = ('topic', 'ctx', 'queue', 'children', 'current_core', 'next_id', 'cache', 'has_local_subs', 'busy', 'last_active', 'live', 'withdrawn')
+
     def __init__(self, topic: str, ctx, queue: asyncio.Queue()) -> None:
         from federator import Context
         self.topic = topic
@@ -50,15 +100,72 @@ class TopicWorker:
         self.queue = queue
         self.children = []
         self.current_core = None
-        self.next_id = 0
-        self.cache = LRUCache(self.ctx.cache_size)
+        self.next_id = first_seqn()
+        # Ids are recorded in the shared store when there is one
+        self.cache = DedupWindow(self.ctx.cache_size) if self.ctx.dedup is None else None
         self.has_local_subs = False
+        self.busy = False
+        self.last_active = time.monotonic()
+        # Only with core refresh, see handle_tick()
+        self.live = Liveness() if self.ctx.timers is not None else None
+        # Core id -> round it last withdrew in, created by the first withdrawal
+        self.withdrawn = None
 
     async def start(self):
+        metrics = self.ctx.metrics
+        handled = 0
         while True:
             msg = await self.queue.get()
             logger.debug(f"WORKER[{self.topic}]: Message received {msg}")
-            await self.handle(msg)
+            self.busy = True
+            try:
+                if metrics is None:
+                    await self.handle(msg)
+                else:
+                    start = time.perf_counter()
+                    await self.handle(msg)
+                    metrics.handled(msg, time.perf_counter() - start)
+            finally:
+                self.busy = False
+                self.last_active = time.monotonic()
+
+            # get() does not suspend while the queue has messages: let the
+            # other workers and the dispatcher run during a long backlog
+            handled += 1
+            if handled % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+    def hibernate(self) -> tuple:
+        """Compact routing state: (core id, dist, parents, children, has_local_subs, next_id).
+
+        The dedup cache is not kept: a topic is only hibernated after being
+        idle long enough that no copy of its last publications is in flight.
+        """
+        if isinstance(self.current_core, CoreBroker):
+            core_id, dist, parents = self.current_core.id, self.current_core.dist, tuple(self.current_core.parents)
+        else:
+            core_id, dist, parents = self.current_core, 0, ()
+        return (core_id, dist, parents, tuple(self.children), self.has_local_subs, self.next_id)
+
+    def restore(self, state: tuple) -> None:
+        core_id, dist, parents, children, has_local_subs, next_id = state
+        if core_id is None or core_id == self.ctx.id:
+            self.current_core = core_id
+        else:
+            self.current_core = CoreBroker(id=core_id, dist=dist, parents=list(parents))
+        self.children = list(children)
+        self.has_local_subs = has_local_subs
+        self.next_id = next_id
+        if self.current_core is not None and self.live is not None:
+            # Restored neighbors get a full timeout to be heard from again
+            now = time.monotonic()
+            for id in parents:
+                self.live.heard[id] = (dist, now)
+            for id in children:
+                self.live.children[id] = now
+            if core_id == self.ctx.id:
+                self.live.seqn = first_round()
+            self.start_ticking()
 
     async def handle(self, msg):
         if isinstance(msg, SubLog):
@@ -70,26 +177,83 @@ class TopicWorker:
         elif isinstance(msg, MeshMembAnn):
             logger.debug(f"WORKER[{self.topic}]:Handle MeshMembAnn...")
             await self.handle_memb_ann(msg)
+        elif isinstance(msg, UnsubLog):
+            logger.debug(f"WORKER[{self.topic}]:Handle last unsubscribe...")
+            await self.handle_unsub()
+        elif isinstance(msg, MeshPrune):
+            logger.debug(f"WORKER[{self.topic}]:Handle MeshPrune...")
+            await self.handle_prune(msg)
         elif isinstance(msg, FederatedPub):
             logger.debug(f"WORKER[{self.topic}]:Handle FederatedPub...")
             await self.handle_publication(msg)
         elif isinstance(msg, RoutedPub):
             logger.debug(f"WORKER[{self.topic}]:Handle RoutedPub...")
             await self.handle_routed_pub(msg)
+        elif isinstance(msg, Tick):
+            if self.live is not None and msg is self.live.tick:
+                await self.handle_tick()
         else:
             logger.error(f"WORKER[{self.topic}]:No Handle for this message type!")
 
 
+    def seen(self, pub_id: PubId) -> bool:
+        if self.cache is None:
+            duplicate = self.ctx.dedup.seen(self.topic, pub_id.origin_id, pub_id.seqn)
+        else:
+            duplicate = self.cache.seen(pub_id.origin_id, pub_id.seqn)
+        if self.ctx.metrics is not None:
+            self.ctx.metrics.dedup_lookups += 1
+            self.ctx.metrics.dedup_hits += duplicate
+        return duplicate
+
+
+    def next_round(self) -> int:
+        """Round above any this broker announced or withdrew the topic in."""
+        seqn = first_round()
+        if self.live is not None and self.current_core == self.ctx.id:
+            seqn = max(seqn, self.live.seqn + 1)
+        if self.withdrawn is not None and self.ctx.id in self.withdrawn:
+            seqn = max(seqn, self.withdrawn[self.ctx.id] + 1)
+        return seqn
+
+
+    def record_withdrawal(self, core_id: int, seqn: int) -> bool:
+        """Remembers that core_id withdrew in round seqn, False if that was known already."""
+        if self.withdrawn is None:
+            self.withdrawn = {}
+        elif seqn <= self.withdrawn.get(core_id, -1):
+            return False
+        self.withdrawn[core_id] = seqn
+        return True
+
+
+    def mesh_active(self):
+        # Local publications of this topic must now reach the federator
+        if self.ctx.interest is not None:
+            self.ctx.interest.add(self.topic)
+        self.start_ticking()
+
+
+    def start_ticking(self):
+        if self.live is not None and not self.live.ticking:
+            self.live.ticking = True
+            self.ctx.timers.schedule(self.ctx.core_refresh, self.topic, self.live.tick)
+
+
     async def handle_sub(self):
         # Two Ways:
         # - Topic doesn't have a core - Announce Core Broker!
         # - Topic have a core Broker - Member Ann ????
         if self.current_core == None:
             logger.debug(f"WORKER[{self.topic}]: Will start announcing as {self.topic} Core...")
+            seqn = self.next_round()
+            if self.live is not None:
+                self.live.seqn = seqn
             announcer = Announcer(self.topic)
-            announcer.announce(copy.copy(self.ctx))
+            await announcer.announce(copy.copy(self.ctx), seqn)
             self.has_local_subs = True
             self.current_core = self.ctx.id
+            self.mesh_active()
             self.children.clear() ## Verify if is necessary
 
         else:  ## Current Core is another broker
@@ -97,6 +261,8 @@ class TopicWorker:
                 logger.debug(f"WORKER[{self.topic}]: Answer parents...")
                 self.has_local_subs = True
                 await self.answer_parents()
+            elif self.current_core == self.ctx.id:
+                self.has_local_subs = True
 
 
 
@@ -106,8 +272,14 @@ class TopicWorker:
         if core_ann.core_id == self.ctx.id or core_ann.sender_id == self.ctx.id:
             logger.debug(f"WORKER[{self.topic}]:Core ID or Sender are Myself!")
             return
+
+        if self.withdrawn is not None and core_ann.seqn <= self.withdrawn.get(core_ann.core_id, -1):
+            # Still flooding from before the core withdrew
+            logger.debug(f"WORKER[{self.topic}]:Stale CoreAnn of withdrawn core {core_ann.core_id}")
+            return
         
         core_ann.dist += 1 # consider distance from the neighbor to me
+        heard_dist = core_ann.dist
         
         # Two ways:
         # - Topic doesn't have a core
@@ -128,6 +300,9 @@ class TopicWorker:
             )
 
             self.current_core = new_core
+            if self.live is not None:
+                self.live.seqn = core_ann.seqn
+            self.mesh_active()
 
             await self.forward(core_ann)
         else:
@@ -164,13 +339,39 @@ class TopicWorker:
                     core.parents.append(core_ann.sender_id)
 
                     await self.forward(core_ann)
+                    if self.live is not None:
+                        self.live.seqn = max(self.live.seqn, core_ann.seqn)
                 else: 
                     pass # Greater distance: Do nothing
 
-
-            elif core_ann.core_id < current_core_id: # Tiebreaker - To implement (Or not)
-                logger.debug(f"WORKER[{self.topic}]:TIEBREAKER!")
-                pass
+                if self.live is not None and core_ann.seqn > self.live.seqn:
+                    # New refresh round: pass it on once and renew our membership
+                    self.live.seqn = core_ann.seqn
+                    core_ann.dist = core.dist
+                    await self.forward(core_ann)
+                    if self.has_local_subs or self.children:
+                        await self.answer_parents()
+
+
+            elif core_ann.core_id < current_core_id: # Tiebreaker: the lowest core id wins
+                logger.info(f"WORKER[{self.topic}]:TIEBREAKER! {core_ann.core_id} replaces core {current_core_id}")
+                self.children.clear()
+                self.current_core = CoreBroker(
+                    id=core_ann.core_id,
+                    dist=core_ann.dist,
+                    parents=[core_ann.sender_id]
+                )
+                if self.live is not None:
+                    self.live.seqn = core_ann.seqn
+                    self.live.heard.clear()
+                    self.live.children.clear()
+
+                await self.forward(core_ann)
+                if self.has_local_subs:
+                    await self.answer_parents()
+
+        if self.live is not None and isinstance(self.current_core, CoreBroker) and self.current_core.id == core_ann.core_id:
+            self.live.heard[core_ann.sender_id] = (heard_dist, time.monotonic())
         
         try:  ## Change this
             logger.debug(f"WORKER[{self.topic}]: Parent list: {self.current_core.parents}") 
@@ -191,6 +392,8 @@ class TopicWorker:
         current_core_id = self.current_core.id if isinstance(self.current_core, CoreBroker) else self.current_core
 
         if current_core_id == memb_ann.core_id:
+            if self.live is not None:
+                self.live.children[memb_ann.sender_id] = time.monotonic()
             if memb_ann.core_id == self.ctx.id:
                 if memb_ann.sender_id not in self.children:
                     self.children.append(memb_ann.sender_id)
@@ -205,6 +408,158 @@ class TopicWorker:
         logger.debug(f"WORKER[{self.topic}]: Children list: {self.children}")
 
 
+    async def handle_unsub(self):
+        # The federator only sends this when the last local subscriber is gone
+        if not self.has_local_subs:
+            return
+        self.has_local_subs = False
+        await self.prune()
+
+
+    async def handle_prune(self, mesh_prune: MeshPrune):
+        if mesh_prune.sender_id == mesh_prune.core_id:
+            await self.handle_withdrawal(mesh_prune)
+            return
+        if mesh_prune.sender_id not in self.children:
+            return
+        logger.info(f"WORKER[{self.topic}]:Child {mesh_prune.sender_id} left the mesh")
+        self.children.remove(mesh_prune.sender_id)
+        await self.prune()
+
+
+    async def prune(self):
+        """Leaves the delivery tree once nothing below this broker is interested."""
+        if self.has_local_subs or self.children or self.current_core is None:
+            return
+
+        if self.current_core == self.ctx.id:
+            # Nobody in the mesh is interested anymore: stop attracting its publications
+            logger.info(f"WORKER[{self.topic}]:No more interest, withdrawing as core...")
+            seqn = self.next_round()
+            self.record_withdrawal(self.ctx.id, seqn)
+            topic, payload = MeshPrune(
+                core_id=self.ctx.id,
+                sender_id=self.ctx.id,
+                seqn=seqn
+            ).serialize(self.topic)
+            self.leave_mesh()
+            for id in self.ctx.neighbors:
+                await self.ctx.send_control(id, topic, payload)
+            return
+
+        logger.info(f"WORKER[{self.topic}]:No more interest, pruning from parents...")
+        topic, payload = MeshPrune(
+            core_id=self.current_core.id,
+            sender_id=self.ctx.id
+        ).serialize(self.topic)
+
+        for id in self.ctx.neighbors:
+            if id in self.current_core.parents:
+                await self.ctx.send_control(id, topic, payload)
+
+
+    async def handle_withdrawal(self, mesh_prune: MeshPrune):
+        # Flooded to every broker, even those the CoreAnns have not reached
+        # yet: they must drop them when they do. The other copies end here.
+        if not self.record_withdrawal(mesh_prune.core_id, mesh_prune.seqn):
+            return
+
+        topic, payload = mesh_prune.serialize(self.topic)
+        for id in self.ctx.neighbors:
+            await self.ctx.send_control(id, topic, payload)
+
+        if not isinstance(self.current_core, CoreBroker) or self.current_core.id != mesh_prune.core_id:
+            return
+
+        logger.info(f"WORKER[{self.topic}]:Core {mesh_prune.core_id} withdrawn")
+        self.leave_mesh()
+
+        if self.has_local_subs:
+            # Subscribed while the core withdrew: start a new mesh
+            self.has_local_subs = False
+            await self.handle_sub()
+
+
+    def leave_mesh(self):
+        """Forgets the core, the parents and the children of the topic."""
+        self.current_core = None
+        self.children.clear()
+        # Without a core local publications have nowhere to go, unless a
+        # local subscriber is about to start a new mesh
+        if self.ctx.interest is not None and not self.has_local_subs:
+            self.ctx.interest.discard(self.topic)
+        if self.live is not None:
+            self.live.heard.clear()
+            self.live.children.clear()
+            self.live.seqn = 0
+
+
+    async def handle_tick(self):
+        """Refreshes the mesh as its core, or expires what was not heard of as a member."""
+        now = time.monotonic()
+        if self.current_core == self.ctx.id:
+            self.live.seqn += 1
+            topic, payload = CoreAnn(
+                core_id=self.ctx.id,
+                dist=0,
+                sender_id=self.ctx.id,
+                seqn=self.live.seqn
+            ).serialize(self.topic)
+            for id in self.ctx.neighbors:
+                await self.ctx.send_control(id, topic, payload)
+        elif isinstance(self.current_core, CoreBroker):
+            await self.expire_parents(now)
+
+        if self.current_core is None:
+            self.live.ticking = False
+            return
+
+        await self.expire_children(now)
+        self.ctx.timers.schedule(self.ctx.core_refresh, self.topic, self.live.tick)
+
+
+    async def expire_parents(self, now: float):
+        live = self.live
+        core: CoreBroker = self.current_core
+        live.heard = {id: heard for id, heard in live.heard.items() if now - heard[1] < self.ctx.core_timeout}
+
+        alive = [id for id in core.parents if id in live.heard]
+        if alive:
+            core.parents = alive
+            return
+
+        # Only neighbors closer to the core than us, the others may be
+        # reaching it through us
+        candidates = {id: dist for id, (dist, _) in live.heard.items() if dist <= core.dist}
+        if candidates:
+            dist = min(candidates.values())
+            core.parents = sorted(id for id, d in candidates.items() if d == dist)[:self.ctx.redundancy]
+            core.dist = dist
+            logger.info(f"WORKER[{self.topic}]:Parents lost, new parents {core.parents}")
+            if self.has_local_subs or self.children:
+                await self.answer_parents()
+            return
+
+        logger.info(f"WORKER[{self.topic}]:Core {core.id} lost!")
+        self.leave_mesh()
+        if self.has_local_subs:
+            # Re-election: the lowest id among the brokers announcing wins
+            self.has_local_subs = False
+            await self.handle_sub()
+
+
+    async def expire_children(self, now: float):
+        stale = [id for id in self.children if now - self.live.children.setdefault(id, now) >= self.ctx.core_timeout]
+        if not stale:
+            return
+
+        logger.info(f"WORKER[{self.topic}]:Children {stale} expired")
+        for id in stale:
+            self.children.remove(id)
+            del self.live.children[id]
+        await self.prune()
+
+
     async def handle_publication(self, federated_pub: FederatedPub):
         logger.debug(f"WORKER[{self.topic}]:Handling FederatedPub...")
         new_id = PubId(
@@ -216,14 +571,21 @@ class TopicWorker:
 
         self.next_id += 1
 
+        trace = None
+        if self.ctx.trace_sample and random.random() < self.ctx.trace_sample:
+            trace = (time.time_ns() // 1000, ())
+
         topic, payload = RoutedPub(
             pub_id=new_id,
             payload=federated_pub.payload,
-            sender_id=self.ctx.id
+            sender_id=self.ctx.id,
+            # Receivers of a wildcard mesh need the topic it was published on
+            topic=federated_pub.topic if federated_pub.topic != self.topic else None,
+            trace=trace
         ).serialize(self.topic)
 
         # cache the message id to prevent it from being routed twice
-        self.cache.put(new_id, None)
+        self.seen(new_id)
 
         # Send to mesh parents
         if isinstance(self.current_core, CoreBroker):
@@ -235,52 +597,66 @@ class TopicWorker:
         logger.debug(f"WORKER[{self.topic}]:Sending RoutedPub to children...")
         await self.send_to(topic, payload, self.children)
 
-        logger.debug(f"WORKER[{self.topic}]:Cache[{self.cache}]")
 
 
 
     async def handle_routed_pub(self, routed_pub: RoutedPub):
         logger.debug(f"WORKER[{self.topic}]:Handling RoutedPub...")
         # Check if message was already routed
-        if self.cache.contains(routed_pub.pub_id):
-            logger.debug(f"WORKER[{self.topic}]:CACHE: Already routed this pub: {routed_pub.pub_id}")
+        pub_id = routed_pub.pub_id
+        if self.seen(pub_id):
+            logger.debug(f"WORKER[{self.topic}]:CACHE: Already routed this pub: {pub_id}")
             return
-        
-        self.cache.put(routed_pub.pub_id, None)
 
         # Send to local subscribers
-        if self.has_local_subs:
+        pub_topic = routed_pub.topic or self.topic
+        if self.has_local_subs and self.ctx.subscriptions.delivers(self.topic, pub_topic):
             logger.debug(f"WORKER[{self.topic}]:Routing pub to local subs...")
 
+            # Delivery edge: the only place the payload is materialized
             topic, payload = FederatedPub(
-                payload=routed_pub.payload
-            ).serialize(self.topic)
+                payload=bytes(routed_pub.payload)
+            ).serialize(pub_topic)
             
-            self.ctx.host_client.publish(topic, payload, HOST_QOS)
+            self.ctx.host_client.publish(topic, payload, HOST_QOS, properties=self.ctx.host_properties)
+
+            if routed_pub.trace is not None and self.ctx.metrics is not None:
+                self.ctx.metrics.traced(self.topic, pub_id.origin_id, routed_pub.trace, self.ctx.id, time.time_ns() // 1000)
         
-        # Set sender_id to myself
         sender_id = routed_pub.sender_id
-        routed_pub.sender_id = self.ctx.id
-
-        topic, payload = routed_pub.serialize(self.topic)
 
-        # Send to mesh parents
+        parents = []
         if isinstance(self.current_core, CoreBroker):
-            logger.debug(f"WORKER[{self.topic}]:Sending RoutedPub to parents...")
             parents = list(self.current_core.parents)
             try:  # Try to remove sender id from parents, if not exist, continue
                 parents.remove(sender_id)
             except ValueError:
                 pass
-            await self.send_to(topic, payload, parents)
 
-        # Send to mesh children
-        logger.debug(f"WORKER[{self.topic}]:Sending RoutedPub to children...")
         children = list(self.children)
         try:  # Try to remove sender id from parents, if not exist, continue
             children.remove(sender_id)
         except ValueError:
             pass
+
+        if not parents and not children:
+            return
+
+        if routed_pub.trace is not None:
+            origin, hops = routed_pub.trace
+            if len(hops) < MAX_HOPS:
+                elapsed = min(max(time.time_ns() // 1000 - origin, 0), 0xFFFFFFFF)
+                routed_pub.trace = (origin, hops + ((self.ctx.id, elapsed),))
+
+        # Set sender_id to myself
+        topic, payload = routed_pub.forward(self.topic, self.ctx.id)
+
+        # Send to mesh parents
+        logger.debug(f"WORKER[{self.topic}]:Sending RoutedPub to parents...")
+        await self.send_to(topic, payload, parents)
+
+        # Send to mesh children
+        logger.debug(f"WORKER[{self.topic}]:Sending RoutedPub to children...")
         await self.send_to(topic, payload, children)
         
 
@@ -289,12 +665,13 @@ class TopicWorker:
         topic, payload = CoreAnn(
             core_id=core_ann.core_id,
             dist=core_ann.dist,
-            sender_id= self.ctx.id
+            sender_id= self.ctx.id,
+            seqn=core_ann.seqn
         ).serialize(self.topic)
 
-        for id, neighbor in self.ctx.neighbors.items():
+        for id in self.ctx.neighbors:
             if id != core_ann.sender_id:
-                neighbor.publish(topic, payload, NEIGHBORS_QOS)
+                await self.ctx.send_control(id, topic, payload)
 
     async def answer_parents(self):
         topic, payload = MeshMembAnn(
@@ -302,9 +679,9 @@ class TopicWorker:
             sender_id=self.ctx.id
         ).serialize(self.topic)
 
-        for id, neighbor in self.ctx.neighbors.items():
+        for id in self.ctx.neighbors:
             if id in self.current_core.parents:
-                neighbor.publish(topic, payload, NEIGHBORS_QOS)
+                await self.ctx.send_control(id, topic, payload)
 
 
     async def send_to(self, topic:str, payload, ids:list):
@@ -312,6 +689,9 @@ class TopicWorker:
             logger.debug(f"WORKER[{self.topic}]:Sending RoutedPub to [{id}]")
             neighbor_client = self.ctx.neighbors.get(id, None)
             if neighbor_client is not None:
-                neighbor_client.publish(topic, payload, NEIGHBORS_QOS)
+                if self.ctx.batchers is not None:
+                    await self.ctx.batchers[id].add(topic, payload)
+                else:
+                    await neighbor_client.publish(topic, payload, NEIGHBORS_QOS)
             else:
                 logger.error(f"WORKER[{self.topic}]:broker {id} is not a neighbor")
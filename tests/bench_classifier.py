@@ -0,0 +1,106 @@
+import timeit
+import argparse
+import fnmatch
+
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+from classifier import TopicClassifier
+from topics import CORE_ANN_TOPIC_LEVEL, MEMB_ANN_TOPIC_LEVEL, ROUTING_TOPICS_LEVEL, SUB_LOGS_TOPIC_LEVEL, FEDERATED_TOPICS_LEVEL
+from topics import SUB_LOGS, ROUTING_TOPICS, MEMB_ANNS, FEDERATED_TOPICS, CORE_ANNS
+from message import SUB_LOG, CORE_ANN, MEMB_ANN, ROUTED_PUB, FEDERATED_PUB, classify
+
+# Microbenchmark: per-message classification cost of the classifier against
+# a startswith chain, as more management prefixes are registered, and of the
+# whole classify() against the deserialize() topic tests it replaced.
+
+TOPICS = [
+    "plant1/line3/sensor42/temperature",
+    "federator/routing/plant1/line3/sensor42/temperature",
+    "federator/core_ann/plant1/line3/sensor42/temperature",
+    "federator/memb_ann/plant1/line3/sensor42/temperature",
+    SUB_LOGS_TOPIC_LEVEL,
+]
+
+SUB_LOG_PAYLOAD = b"1700000000: client-42 1 plant1/line3/sensor42/temperature"
+MESSAGES = [(topic, SUB_LOG_PAYLOAD if topic == SUB_LOGS_TOPIC_LEVEL else b"") for topic in TOPICS]
+
+
+def baseline_classify(topic: str, payload: bytes):
+    """The topic tests of the original deserialize(), without unpickling."""
+    if topic.startswith(SUB_LOGS_TOPIC_LEVEL):
+        fed_topic = payload.decode('utf-8').split(' ')[-1]
+        if fnmatch.fnmatch(fed_topic, SUB_LOGS) or \
+            fnmatch.fnmatch(fed_topic, ROUTING_TOPICS) or \
+            fnmatch.fnmatch(fed_topic, MEMB_ANNS) or \
+            fnmatch.fnmatch(fed_topic, FEDERATED_TOPICS) or \
+            fnmatch.fnmatch(fed_topic, CORE_ANNS):
+            return SUB_LOG, None
+        return SUB_LOG, fed_topic
+    elif topic.startswith(CORE_ANN_TOPIC_LEVEL):
+        return CORE_ANN, topic[len(CORE_ANN_TOPIC_LEVEL):]
+    elif topic.startswith(MEMB_ANN_TOPIC_LEVEL):
+        return MEMB_ANN, topic[len(MEMB_ANN_TOPIC_LEVEL):]
+    elif topic.startswith(ROUTING_TOPICS_LEVEL):
+        return ROUTED_PUB, topic[len(ROUTING_TOPICS_LEVEL):]
+    elif topic.startswith(FEDERATED_TOPICS_LEVEL):
+        return FEDERATED_PUB, topic[len(FEDERATED_TOPICS_LEVEL):]
+
+
+def build(extra: int):
+    prefixes = [
+        (CORE_ANN_TOPIC_LEVEL, CORE_ANN),
+        (MEMB_ANN_TOPIC_LEVEL, MEMB_ANN),
+        (ROUTING_TOPICS_LEVEL, ROUTED_PUB),
+    ] + [(f"federator/extension{i}/", FEDERATED_PUB + 1 + i) for i in range(extra)]
+
+    classifier = TopicClassifier(default_kind=FEDERATED_PUB)
+    classifier.add_topic(SUB_LOGS_TOPIC_LEVEL, SUB_LOG)
+    for prefix, kind in prefixes:
+        classifier.add_prefix(prefix, kind)
+
+    # Extensions are checked first, as new prefixes would be added to the chain
+    chain = [(SUB_LOGS_TOPIC_LEVEL, SUB_LOG)] + prefixes[3:] + prefixes[:3]
+
+    def startswith_chain(topic):
+        for prefix, kind in chain:
+            if topic.startswith(prefix):
+                return kind, len(prefix)
+        return FEDERATED_PUB, 0
+
+    return classifier.match, startswith_chain
+
+
+def per_message_ns(match, number: int) -> float:
+    def run():
+        for topic in TOPICS:
+            match(topic)
+    return timeit.timeit(run, number=number) / (number * len(TOPICS)) * 1e9
+
+
+def per_message_full_ns(classify_message, number: int) -> float:
+    def run():
+        for topic, payload in MESSAGES:
+            classify_message(topic, payload)
+    return timeit.timeit(run, number=number) / (number * len(MESSAGES)) * 1e9
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Topic classifier microbenchmark')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='Rounds over the sample topics')
+    args = parser.parse_args()
+
+    print(f"{'prefixes':>9} {'classifier ns/msg':>18} {'startswith ns/msg':>18}")
+    for extra in (0, 10, 100, 1000):
+        classifier, chain = build(extra)
+        print(f"{extra + 4:>9} {per_message_ns(classifier, args.number):>18.0f} {per_message_ns(chain, args.number):>18.0f}")
+
+    print()
+    print(f"{'classify() ns/msg':>18} {'baseline deserialize() ns/msg':>30}")
+    print(f"{per_message_full_ns(classify, args.number):>18.0f} {per_message_full_ns(baseline_classify, args.number):>30.0f}")
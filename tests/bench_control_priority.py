@@ -0,0 +1,112 @@
+import asyncio
+import argparse
+import logging
+import time
+
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+import paho.mqtt.client as mqtt
+from federator import Federator, Context, is_control_mqtt
+from ingress import Ingress
+from channel import OutboundChannel
+from topics import SUB_LOGS_TOPIC_LEVEL
+
+# Benchmark: time for a new subscriber to join the mesh of a topic, up a
+# chain of brokers to its core, while that topic is flooded with
+# publications, with and without control-plane priority. Brokers and links
+# are in memory, no MQTT broker is needed.
+
+
+class PublishInfo:
+    def __init__(self, mid: int) -> None:
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+        self.mid = mid
+
+
+class LinkClient:
+    """Stands in for a paho client: publishes go straight into another federator's ingress."""
+    def __init__(self, target: Ingress = None) -> None:
+        self.target = target
+        self.on_publish = None
+        self.mid = 0
+
+    def max_inflight_messages_set(self, inflight: int) -> None:
+        pass
+
+    def subscribe(self, topic, qos=0, options=None, properties=None) -> None:
+        pass
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None) -> PublishInfo:
+        self.mid += 1
+        loop = asyncio.get_running_loop()
+        if self.target is not None:
+            loop.call_soon(self.target.put, message(topic, bytes(payload)))
+        if self.on_publish is not None:
+            loop.call_soon(self.on_publish, self, None, self.mid)
+        return PublishInfo(self.mid)
+
+
+def message(topic: str, payload: bytes) -> mqtt.MQTTMessage:
+    msg = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+    msg.payload = payload
+    return msg
+
+
+def sub_log(topic: str) -> mqtt.MQTTMessage:
+    return message(SUB_LOGS_TOPIC_LEVEL, f"0: bench 2 {topic}".encode('utf-8'))
+
+
+async def converge(brokers: int, flood: int, priority: bool) -> float:
+    loop = asyncio.get_running_loop()
+    is_control = is_control_mqtt if priority else None
+    ingress = {id: Ingress(loop, is_control) for id in range(brokers)}
+
+    federators = {}
+    for id in range(brokers):
+        links = [n for n in (id - 1, id + 1) if 0 <= n < brokers]
+        neighbors = {n: OutboundChannel(n, LinkClient(ingress[n]), loop, 1000, 1 << 30, "block") for n in links}
+        ctx = Context(id, 1, 1000, neighbors, LinkClient(), control_priority=priority)
+        federators[id] = Federator(ctx, ingress[id])
+        loop.create_task(federators[id].run())
+
+    # Mesh of the flooded topic: core at the last broker, publisher at the first
+    ingress[brokers - 1].put(sub_log("flood"))
+    await asyncio.sleep(0.1)
+
+    # A subscriber joins at the publishing broker behind the flood, its
+    # membership announcement then travels against the flood to the core
+    for i in range(flood):
+        ingress[0].put(message("flood", b"%08d" % i))
+    ingress[0].put(sub_log("flood"))
+
+    start = time.perf_counter()
+    while True:
+        joined = [id in federators[id + 1].workers["flood"].worker.children for id in range(brokers - 1)]
+        if all(joined):
+            return time.perf_counter() - start
+        await asyncio.sleep(0.001)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesh join convergence under publication load")
+    parser.add_argument("--brokers", type=int, default=5, help="Length of the broker chain")
+    parser.add_argument("--flood", type=int, default=20000, help="Publications queued ahead of the announcement")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for priority in (False, True):
+        elapsed = asyncio.run(converge(args.brokers, args.flood, priority))
+        print(f"control_priority={str(priority).lower():5}  {args.brokers} brokers, {args.flood} queued publications: "
+              f"joined the mesh after {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import asyncio
+import argparse
+import dataclasses
+import glob
+import json
+import logging
+import random
+import resource
+import struct
+import subprocess
+import time
+
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+import toml
+import federator
+import loopback
+from conf import read_config_file, FederatorConfig, BrokerConfig
+from transport import TRANSPORT_LOOPBACK
+from message import set_wire_format
+from metrics import Metrics
+from topologies import generate, TOPOLOGIES
+
+# Benchmark: a whole federation on loopback brokers in one process, driven by
+# synthetic publishers and subscribers. Reports delivered messages per second,
+# delivery latency, duplicate and missing deliveries, and the time each
+# federator spent handling messages, as JSON to compare across versions.
+
+SCENARIO = os.path.join(os.path.dirname(__file__), '..', 'federation_scenario', 'configs', 'fed*-config.toml')
+BASE_PORT = 20000
+
+# Publication payload: sequence number and send time, then padding
+STAMP = struct.Struct("!Qd")
+
+
+def scenario_configs(pattern: str) -> list:
+    configs = [read_config_file(path) for path in sorted(glob.glob(pattern))]
+    if not configs or any(config is None for config in configs):
+        raise SystemExit(f"Cannot load the configurations {pattern}")
+    return [dataclasses.replace(config, transport=TRANSPORT_LOOPBACK) for config in configs]
+
+
+def generated_configs(adjacency: dict, redundancy: int, cache_size: int) -> list:
+    def broker(id: int) -> BrokerConfig:
+        return BrokerConfig(id=id, ip="127.0.0.1", port=BASE_PORT + id)
+
+    return [
+        FederatorConfig(
+            redundancy=redundancy,
+            cache_size=cache_size,
+            host=broker(id),
+            neighbors=[broker(other) for other in neighbors],
+            transport=TRANSPORT_LOOPBACK
+        )
+        for id, neighbors in adjacency.items()
+    ]
+
+
+def apply_settings(configs: list, settings: list) -> list:
+    """Overrides configuration keys given as key=value, the value in TOML syntax or a bare string."""
+    overrides = {}
+    for setting in settings:
+        key, _, value = setting.partition('=')
+        try:
+            overrides[key.strip()] = toml.loads(f"value = {value}")['value']
+        except toml.TomlDecodeError:
+            # engine=pool rather than engine='"pool"'
+            overrides[key.strip()] = value.strip()
+    return [dataclasses.replace(config, **overrides) for config in configs]
+
+
+def git_version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, cwd=src_path).stdout.strip()
+    except OSError:
+        return ""
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def rss_kb() -> int:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def time_dispatch(fed: federator.Federator, busy: dict) -> None:
+    """Adds the time spent in fed.dispatch() to busy[fed.ctx.id]."""
+    dispatch = fed.dispatch
+
+    async def timed(mqtt_msg):
+        start = time.perf_counter()
+        await dispatch(mqtt_msg)
+        busy[fed.ctx.id] += time.perf_counter() - start
+
+    fed.dispatch = timed
+
+
+async def benchmark(configs: list, args) -> dict:
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+    loopback.reset()
+
+    busy = {config.host.id: 0.0 for config in configs}
+    federators = []
+    for config in configs:
+        fed = federator.start(loop, config)
+        # Worker handling time, measured by the metrics
+        fed.ctx.metrics = Metrics(1)
+        time_dispatch(fed, busy)
+        federators.append(fed)
+    await asyncio.sleep(0.05)
+
+    hosts = [config.host for config in configs]
+    topics = [f"bench/{i}/data" for i in range(args.topics)]
+
+    deliveries = {}
+    latencies = []
+    duplicates = 0
+
+    def on_message(client, userdata, msg):
+        nonlocal duplicates
+        seqn, sent = STAMP.unpack_from(msg.payload)
+        key = (client.client_id, seqn)
+        if key in deliveries:
+            duplicates += 1
+            return
+        deliveries[key] = True
+        latencies.append(time.perf_counter() - sent)
+
+    fan_out = min(args.fan_out, len(hosts))
+    for topic in topics:
+        for i, host in enumerate(rng.sample(hosts, fan_out)):
+            client = loopback.LoopbackClient(f"bench-sub-{topic}-{i}")
+            client.connect(host.ip, host.port)
+            client.on_message = on_message
+            client.subscribe(topic, qos=2)
+
+    publishers = []
+    for topic in topics:
+        host = rng.choice(hosts)
+        client = loopback.LoopbackClient(f"bench-pub-{topic}")
+        client.connect(host.ip, host.port)
+        publishers.append((topic, client))
+
+    # Meshes are built before the measure starts
+    await asyncio.sleep(args.settle)
+    for id in busy:
+        busy[id] = 0.0
+    for fed in federators:
+        fed.ctx.metrics.latency.clear()
+
+    padding = b"\0" * max(args.payload_size - STAMP.size, 0)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+
+    published = 0
+    deadline = start + args.duration
+    tick = 0.01
+    while time.perf_counter() < deadline:
+        # Rate 0: as fast as the federation takes them
+        due = args.rate * (time.perf_counter() - start) if args.rate > 0 else published + 100
+        while published < due:
+            topic, client = publishers[published % len(publishers)]
+            client.publish(topic, STAMP.pack(published, time.perf_counter()) + padding, qos=2)
+            published += 1
+        await asyncio.sleep(tick if args.rate > 0 else 0)
+
+    # Wait for the last deliveries
+    expected = published * fan_out
+    last, idle_since = -1, time.perf_counter()
+    while len(deliveries) < expected and time.perf_counter() - idle_since < args.drain:
+        if len(deliveries) != last:
+            last, idle_since = len(deliveries), time.perf_counter()
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    latencies.sort()
+    per_federator = []
+    for config, fed in zip(configs, federators):
+        handled = sum(histogram.sum for histogram in fed.ctx.metrics.latency.values())
+        per_federator.append({
+            'id': config.host.id,
+            'busy_s': round(busy[config.host.id] + handled, 4),
+            'cpu_share': round((busy[config.host.id] + handled) / elapsed, 4),
+            'topics': len(fed.workers) + len(fed.hibernated) + (len(fed.pool.table) if fed.pool is not None else 0),
+        })
+
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+
+    return {
+        'published': published,
+        'expected_deliveries': expected,
+        'delivered': len(deliveries),
+        'missing': expected - len(deliveries),
+        'duplicates': duplicates,
+        'elapsed_s': round(elapsed, 4),
+        'delivered_per_s': round(len(deliveries) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        'process': {
+            'cpu_s': round(end_usage.ru_utime + end_usage.ru_stime - usage.ru_utime - usage.ru_stime, 4),
+            'rss_kb': rss_kb(),
+            'max_rss_kb': end_usage.ru_maxrss,
+        },
+        'federators': per_federator,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Federation throughput and latency on loopback brokers")
+    parser.add_argument("--scenario", type=str, default=SCENARIO, help="Glob of federator configuration files to load")
+    parser.add_argument("--topology", choices=TOPOLOGIES, help="Generate a topology instead of loading the scenario")
+    parser.add_argument("--brokers", type=int, default=20, help="Brokers of a generated topology")
+    parser.add_argument("--links", type=int, default=2, help="Links per new broker of a scale-free topology")
+    parser.add_argument("--redundancy", type=int, default=2, help="Redundancy of a generated topology")
+    parser.add_argument("--cache-size", type=int, default=500, help="cache_size of a generated topology")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Override a configuration key, e.g. --set batch_linger_ms=5 or --set engine=pool")
+    parser.add_argument("--topics", type=int, default=10, help="Published topics")
+    parser.add_argument("--fan-out", type=int, default=3, help="Subscribers per topic, each on a different broker")
+    parser.add_argument("--payload-size", type=int, default=64, help="Publication size in bytes (at least 16)")
+    parser.add_argument("--rate", type=float, default=500, help="Publications per second over all topics, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of publishing")
+    parser.add_argument("--settle", type=float, default=1, help="Seconds given to the meshes to form before publishing")
+    parser.add_argument("--drain", type=float, default=2, help="Seconds without deliveries after which the run ends")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the subscriber and publisher placement")
+    parser.add_argument("--output", type=str, help="Append the JSON result as one line to this file instead of printing it")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    if args.topology:
+        adjacency = generate(args.topology, args.brokers, args.links, args.seed)
+        configs = generated_configs(adjacency, args.redundancy, args.cache_size)
+        topology = {'kind': args.topology, 'brokers': len(configs), 'links': sum(map(len, adjacency.values())) // 2}
+    else:
+        configs = scenario_configs(args.scenario)
+        topology = {'kind': 'scenario', 'path': args.scenario, 'brokers': len(configs)}
+    configs = apply_settings(configs, args.set)
+
+    set_wire_format(configs[0].wire_format, configs[0].accept_pickle)
+
+    report = {
+        'version': git_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'topology': topology,
+        'settings': args.set,
+        'workload': {
+            'topics': args.topics,
+            'fan_out': args.fan_out,
+            'payload_size': args.payload_size,
+            'rate': args.rate,
+            'duration': args.duration,
+            'seed': args.seed,
+        },
+        'results': asyncio.run(benchmark(configs, args)),
+    }
+
+    if args.output:
+        with open(args.output, 'a') as file:
+            file.write(json.dumps(report) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+import argparse
+import logging
+import time
+
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+from federator import Federator, Context
+from ingress import Ingress
+from channel import OutboundChannel
+from metrics import Metrics, exposition
+from bench_control_priority import LinkClient, message, sub_log
+
+# Benchmark: cost of the metrics on the message path. Publications go from
+# one broker to a subscriber on its neighbor, in memory, with metrics off and
+# on; the rate difference is the overhead.
+
+
+async def throughput(publications: int, with_metrics: bool) -> float:
+    loop = asyncio.get_running_loop()
+    ingress = {id: Ingress(loop) for id in (0, 1)}
+    hosts = {id: LinkClient() for id in (0, 1)}
+
+    federators = {}
+    for id, other in ((0, 1), (1, 0)):
+        neighbors = {other: OutboundChannel(other, LinkClient(ingress[other]), loop, 1000, 1 << 30, "block")}
+        metrics = Metrics(20) if with_metrics else None
+        ctx = Context(id, 1, 1000, neighbors, hosts[id], metrics=metrics)
+        federators[id] = Federator(ctx, ingress[id])
+        loop.create_task(federators[id].run())
+
+    # Core at the publishing broker, subscriber on the other one
+    ingress[0].put(sub_log("bench/topic"))
+    await asyncio.sleep(0.05)
+    ingress[1].put(sub_log("bench/topic"))
+    await asyncio.sleep(0.05)
+
+    delivered = hosts[1].mid
+    start = time.perf_counter()
+    for i in range(publications):
+        ingress[0].put(message("bench/topic", b"%08d" % i))
+    while hosts[1].mid - delivered < publications:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    if with_metrics:
+        start = time.perf_counter()
+        exposition(federators[1])
+        print(f"  scrape rendered in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    return publications / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overhead of the metrics on the message path")
+    parser.add_argument("--publications", type=int, default=50000, help="Publications per run")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per setting, the best one is kept")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    rates = {}
+    for with_metrics in (False, True):
+        rates[with_metrics] = max(asyncio.run(throughput(args.publications, with_metrics)) for _ in range(args.runs))
+        print(f"metrics={'on' if with_metrics else 'off':3}  {rates[with_metrics]:,.0f} publications/s")
+
+    print(f"overhead: {(1 - rates[True] / rates[False]) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -41,11 +41,12 @@ def on_connect(client, userdata, flags, rc):
 
 def on_message(client, userdata, msg):
     if not any(topic in msg.topic for topic in EXCLUDED_TOPICS):
-        try:
-            print(f'{userdata.id} - {msg.topic} - {msg.payload.decode()}')
-        except:
-            payload = pickle.loads(msg.payload)
+        kind, _ = classify(msg.topic, msg.payload)
+        if kind in (CORE_ANN, MEMB_ANN, ROUTED_PUB):
+            payload = decode_frame(kind, msg.payload)
             print(f'{userdata.id} - {msg.topic} - {payload}')
+        else:
+            print(f'{userdata.id} - {msg.topic} - {msg.payload.decode(errors="replace")}')
 
 
 if __name__ == '__main__':
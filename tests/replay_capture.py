@@ -0,0 +1,150 @@
+import asyncio
+import argparse
+import dataclasses
+import json
+import logging
+import time
+
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+import paho.mqtt.client as mqtt
+import federator
+import loopback
+import capture
+from conf import read_config_file
+from transport import TRANSPORTS, TRANSPORT_LOOPBACK
+from message import set_wire_format
+from metrics import Metrics, KIND_NAMES
+from ingress import MAX_BATCH
+
+# Replays a capture (see capture_path) into a federator: the recorded inbound
+# messages are put on its ingress as the host client would, at the original
+# pace, a multiple of it, or as fast as the federator takes them. The
+# federator runs on loopback brokers unless another transport is given, so
+# what it sends goes nowhere. Reports the replay rate, how far it fell behind
+# the captured pace, and the messages received by kind, as JSON.
+
+# Queued messages above which an as-fast-as-possible replay waits for the federator
+MAX_QUEUED = 4 * MAX_BATCH
+
+
+def pending(fed: federator.Federator) -> int:
+    """Messages received and not handled yet."""
+    queued = fed.ingress.qsize()
+    if fed.pool is not None:
+        return queued + sum(lane.qsize() for lane in fed.pool.lanes)
+    return queued + sum(worker.get_queue().qsize() for worker in fed.workers.values())
+
+
+async def replay(config, args) -> dict:
+    loop = asyncio.get_running_loop()
+    loopback.reset()
+
+    fed = federator.start(loop, config)
+    if fed.ctx.metrics is None:
+        fed.ctx.metrics = Metrics(1)
+    # Let the federator subscribe before the first message
+    await asyncio.sleep(0.05)
+
+    replayed = 0
+    skipped = 0
+    replayed_bytes = 0
+    max_lag = 0.0
+    first_ns = last_ns = None
+    start = time.perf_counter()
+
+    for time_ns, source, qos, topic, payload in capture.read(args.capture):
+        if args.source is not None and source != args.source:
+            skipped += 1
+            continue
+        if first_ns is None:
+            first_ns = time_ns
+        last_ns = time_ns
+
+        if args.speed > 0:
+            due = start + (time_ns - first_ns) / 1e9 / args.speed
+            now = time.perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+            else:
+                max_lag = max(max_lag, now - due)
+        elif replayed % MAX_BATCH == 0:
+            await asyncio.sleep(0)
+            while pending(fed) > MAX_QUEUED:
+                await asyncio.sleep(0)
+
+        msg = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+        msg.payload = payload
+        msg.qos = qos
+        fed.ingress.put(msg)
+        replayed += 1
+        replayed_bytes += len(payload)
+
+    # Until the federator has handled everything
+    while pending(fed) > 0:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+
+    span = (last_ns - first_ns) / 1e9 if first_ns is not None else 0.0
+    return {
+        'replayed': replayed,
+        'skipped': skipped,
+        'payload_bytes': replayed_bytes,
+        'captured_span_s': round(span, 4),
+        'elapsed_s': round(elapsed, 4),
+        'messages_per_s': round(replayed / elapsed, 1) if elapsed > 0 else 0.0,
+        'speedup': round(span / elapsed, 2) if elapsed > 0 else 0.0,
+        'max_lag_ms': round(max_lag * 1000, 3),
+        'received': {name: fed.ctx.metrics.received[kind] for kind, name in KIND_NAMES.items() if fed.ctx.metrics.received[kind]},
+        'topics': len(fed.workers) + len(fed.hibernated) + (len(fed.pool.table) if fed.pool is not None else 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a capture into a federator")
+    parser.add_argument("capture", type=str, help="Capture file written with capture_path")
+    parser.add_argument("-c", "--config", type=str, required=True, help="Configuration of the federator to replay into")
+    parser.add_argument("--speed", type=float, default=1, help="Multiple of the captured pace, 0 for as fast as possible")
+    parser.add_argument("--source", type=int, help="Only replay the messages captured by this broker id")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT_LOOPBACK, help="Transport of the federator")
+    parser.add_argument("--output", type=str, help="Append the JSON result as one line to this file instead of printing it")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    config = read_config_file(args.config)
+    if config is None:
+        raise SystemExit(f"Cannot load the configuration {args.config}")
+    # Replayed messages must not be captured again; shards run in other processes
+    config = dataclasses.replace(config, transport=args.transport, capture_path="", shards=0)
+
+    set_wire_format(config.wire_format, config.accept_pickle)
+
+    report = {
+        'capture': args.capture,
+        'config': args.config,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'speed': args.speed,
+        'results': asyncio.run(replay(config, args)),
+    }
+
+    if args.output:
+        with open(args.output, 'a') as file:
+            file.write(json.dumps(report) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
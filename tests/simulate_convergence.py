@@ -0,0 +1,307 @@
+import argparse
+import heapq
+import json
+import logging
+import random
+import statistics
+import time
+
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+from federator import Context
+from worker import TopicWorker, CoreBroker
+from message import classify, decode, opens_topic, set_wire_format, SubLog, UnsubLog, FederatedPub, CONTROL_KINDS, ROUTED_PUB, WIRE_FORMATS, WIRE_BINARY
+from topologies import generate, TOPOLOGIES
+
+# Discrete-event simulation of the mesh control plane on large federations.
+# Every broker runs the real TopicWorker logic on real wire frames; links and
+# brokers are simulated in virtual time: a frame reaches its neighbor after
+# the link latency, and each broker handles one message at a time, taking
+# the service time for each. Subscribers join, the meshes converge, then
+# publications go through them. Core refresh is not simulated.
+
+
+class SimLink:
+    """Stands in for the OutboundChannel to a neighbor."""
+    def __init__(self, sim: 'Simulation', src: int, dst: int) -> None:
+        self.sim = sim
+        self.src = src
+        self.dst = dst
+
+    async def publish(self, topic: str, payload, qos: int, control: bool = False) -> None:
+        self.sim.send(self.src, self.dst, topic, bytes(payload))
+
+
+class SimHost:
+    """Stands in for the host client, records deliveries to local subscribers."""
+    def __init__(self, sim: 'Simulation', id: int) -> None:
+        self.sim = sim
+        self.id = id
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None) -> None:
+        self.sim.stats(topic).delivered += 1
+
+
+class TopicStats:
+    __slots__ = ('subscribed_at', 'converged_at', 'control', 'routed', 'duplicates', 'delivered', 'expected')
+
+    def __init__(self) -> None:
+        self.subscribed_at = None
+        self.converged_at = 0.0
+        self.control = 0
+        self.routed = 0
+        self.duplicates = 0
+        self.delivered = 0
+        self.expected = 0
+
+
+def drive(coro) -> None:
+    """Runs a worker handler to completion: simulated links never suspend it."""
+    try:
+        coro.send(None)
+    except StopIteration:
+        return
+    coro.close()
+    raise RuntimeError("A worker handler suspended inside the simulation")
+
+
+class Simulation:
+    def __init__(self, adjacency: dict, redundancy: int, cache_size: int, latency: float, jitter: float, service: float, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.service = service
+        self.now = 0.0
+        # (time, sequence, broker, item): items are wire frames (topic, payload)
+        # from neighbors or local messages (federated topic, message)
+        self.events = []
+        self.sequence = 0
+        self.free = {id: 0.0 for id in adjacency}
+        self.contexts = {
+            id: Context(
+                id=id,
+                redundancy=redundancy,
+                cache_size=cache_size,
+                neighbors={other: SimLink(self, id, other) for other in neighbors},
+                host_client=SimHost(self, id)
+            )
+            for id, neighbors in adjacency.items()
+        }
+        self.workers = {id: {} for id in adjacency}
+        self.topics = {}
+        self.routed_seen = set()
+        self.processed = 0
+        self.control_load = {id: 0 for id in adjacency}
+
+    def stats(self, topic: str) -> TopicStats:
+        stats = self.topics.get(topic)
+        if stats is None:
+            stats = self.topics[topic] = TopicStats()
+        return stats
+
+    def schedule(self, at: float, broker: int, item: tuple) -> None:
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, broker, item))
+
+    def send(self, src: int, dst: int, topic: str, payload: bytes) -> None:
+        delay = self.latency * (1 + self.jitter * (2 * self.rng.random() - 1))
+        self.schedule(self.now + delay, dst, (False, topic, payload))
+
+    def subscribe(self, at: float, broker: int, topic: str) -> None:
+        stats = self.stats(topic)
+        if stats.subscribed_at is None or at < stats.subscribed_at:
+            stats.subscribed_at = at
+        self.schedule(at, broker, (True, topic, SubLog(f"sim-{broker} 2 {topic}")))
+
+    def publish(self, at: float, broker: int, topic: str, payload: bytes) -> None:
+        msg = FederatedPub(payload)
+        msg.topic = topic
+        self.schedule(at, broker, (True, topic, msg))
+
+    def unsubscribe(self, at: float, broker: int, topic: str) -> None:
+        self.schedule(at, broker, (True, topic, UnsubLog(f"sim-{broker} {topic}")))
+
+    def run(self, limit: int = 0) -> float:
+        """Processes events until none is left, or limit events when above 0, returns the virtual time reached."""
+        while self.events and not (limit and self.processed >= limit):
+            at, sequence, broker, item = heapq.heappop(self.events)
+            if self.free[broker] > at:
+                # Busy broker: the message waits in its queue, keeping its order
+                heapq.heappush(self.events, (self.free[broker], sequence, broker, item))
+                continue
+            self.now = at + self.service
+            self.free[broker] = self.now
+            self.handle(broker, item)
+        return self.now
+
+    def handle(self, broker: int, item: tuple) -> None:
+        self.processed += 1
+        local, topic, data = item
+        if local:
+            fed_topic, msg = topic, data
+        else:
+            kind, fed_topic = classify(topic, data)
+            msg = decode(kind, data)
+            stats = self.stats(fed_topic)
+            if kind in CONTROL_KINDS:
+                stats.control += 1
+                stats.converged_at = self.now
+                self.control_load[broker] += 1
+            elif kind == ROUTED_PUB:
+                stats.routed += 1
+                key = (broker, msg.pub_id)
+                if key in self.routed_seen:
+                    stats.duplicates += 1
+                self.routed_seen.add(key)
+
+        workers = self.workers[broker]
+        worker = workers.get(fed_topic)
+        if worker is None:
+            if not opens_topic(msg):
+                return
+            worker = workers[fed_topic] = TopicWorker(fed_topic, self.contexts[broker], None)
+        drive(worker.handle(msg))
+
+    def mesh(self, topic: str) -> dict:
+        """Broker -> distance to the core of the brokers in the delivery tree of topic."""
+        members = {}
+        for broker, workers in self.workers.items():
+            worker = workers.get(topic)
+            if worker is None or not (worker.has_local_subs or worker.children):
+                continue
+            if isinstance(worker.current_core, CoreBroker):
+                members[broker] = worker.current_core.dist
+            elif worker.current_core == broker:
+                members[broker] = 0
+        return members
+
+
+class ErrorCounter(logging.Handler):
+    """Counts the errors logged by the workers instead of printing them."""
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record) -> None:
+        self.count += 1
+
+
+def summary(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        'mean': round(statistics.mean(values), 3),
+        'p50': values[len(values) // 2],
+        'max': values[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control plane convergence on a simulated federation")
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="scale-free", help="Generated topology")
+    parser.add_argument("--brokers", type=int, default=500, help="Number of brokers")
+    parser.add_argument("--links", type=int, default=2, help="Links per new broker of a scale-free topology")
+    parser.add_argument("--redundancy", type=int, default=2, help="Parents kept by each mesh member")
+    parser.add_argument("--cache-size", type=int, default=64, help="Dedup window width")
+    parser.add_argument("--wire-format", choices=WIRE_FORMATS, default=WIRE_BINARY, help="Frame encoding")
+    parser.add_argument("--topics", type=int, default=5, help="Simulated topics")
+    parser.add_argument("--subscribers", type=int, default=20, help="Subscribing brokers per topic")
+    parser.add_argument("--join-window", type=float, default=0.0, help="Subscriptions are spread over this many seconds")
+    parser.add_argument("--publications", type=int, default=10, help="Publications per topic once converged")
+    parser.add_argument("--latency", type=float, default=0.002, help="Link latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Relative link latency jitter")
+    parser.add_argument("--service", type=float, default=0.00005, help="Seconds a broker takes per message")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    # Joins racing with core elections log errors: counted, not printed
+    errors = ErrorCounter()
+    worker_logger = logging.getLogger('worker')
+    worker_logger.addHandler(errors)
+    worker_logger.propagate = False
+    set_wire_format(args.wire_format)
+
+    adjacency = generate(args.topology, args.brokers, args.links, args.seed)
+    sim = Simulation(adjacency, args.redundancy, args.cache_size, args.latency, args.jitter, args.service, args.seed)
+    brokers = list(adjacency)
+    topics = [f"sim/{i}" for i in range(args.topics)]
+
+    started = time.perf_counter()
+
+    subscribers = {}
+    for topic in topics:
+        subscribers[topic] = sim.rng.sample(brokers, min(args.subscribers, len(brokers)))
+        for broker in subscribers[topic]:
+            sim.subscribe(sim.rng.uniform(0, args.join_window), broker, topic)
+    converged = sim.run()
+
+    meshes = {topic: sim.mesh(topic) for topic in topics}
+
+    start = converged + 1
+    for topic in topics:
+        for i in range(args.publications):
+            broker = sim.rng.choice(brokers)
+            sim.publish(start + i * 0.001, broker, topic, b"%08d" % i)
+            # Local subscribers get it from their broker, not through the mesh
+            sim.stats(topic).expected += sum(1 for subscriber in subscribers[topic] if subscriber != broker)
+    sim.run()
+
+    elapsed = time.perf_counter() - started
+
+    per_topic = {}
+    for topic in topics:
+        stats = sim.topics[topic]
+        mesh = meshes[topic]
+        per_topic[topic] = {
+            'control_messages': stats.control,
+            'convergence_s': round(stats.converged_at - stats.subscribed_at, 6),
+            'mesh_brokers': len(mesh),
+            'mesh_depth': max(mesh.values(), default=0),
+            'routed_pubs': stats.routed,
+            'duplicate_routed_pubs': stats.duplicates,
+            'deliveries': stats.delivered,
+            'expected_deliveries': stats.expected,
+        }
+
+    links = sum(map(len, adjacency.values())) // 2
+    report = {
+        'topology': {'kind': args.topology, 'brokers': len(brokers), 'links': links, 'redundancy': args.redundancy},
+        'workload': {'topics': args.topics, 'subscribers': args.subscribers, 'publications': args.publications},
+        'control_messages_per_topic': summary([t['control_messages'] for t in per_topic.values()]),
+        'control_messages_per_link': round(sum(t['control_messages'] for t in per_topic.values()) / len(topics) / links, 3),
+        'max_control_messages_per_broker': max(sim.control_load.values()),
+        'convergence_s': summary([t['convergence_s'] for t in per_topic.values()]),
+        'mesh_depth': summary([t['mesh_depth'] for t in per_topic.values()]),
+        'duplicate_routed_pubs_per_publication': round(sum(t['duplicate_routed_pubs'] for t in per_topic.values()) / max(len(topics) * args.publications, 1), 3),
+        'missing_deliveries': sum(t['expected_deliveries'] - t['deliveries'] for t in per_topic.values()),
+        'worker_errors': errors.count,
+        'events': sim.processed,
+        'wall_s': round(elapsed, 2),
+        'topics': per_topic,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.topology} topology, {len(brokers)} brokers, {links} links, redundancy {args.redundancy}: "
+          f"{sim.processed} events simulated in {elapsed:.1f} s, {errors.count} worker errors logged")
+    print(f"{'topic':>10} {'control':>9} {'per link':>9} {'converge':>10} {'mesh':>6} {'depth':>6} {'routed':>8} {'dups':>6} {'missing':>8}")
+    for topic, t in per_topic.items():
+        print(f"{topic:>10} {t['control_messages']:>9} {t['control_messages'] / links:>9.2f} {t['convergence_s'] * 1000:>8.1f}ms "
+              f"{t['mesh_brokers']:>6} {t['mesh_depth']:>6} {t['routed_pubs']:>8} {t['duplicate_routed_pubs']:>6} "
+              f"{t['expected_deliveries'] - t['deliveries']:>8}")
+
+
+if __name__ == "__main__":
+    main()
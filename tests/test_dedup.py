@@ -0,0 +1,68 @@
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+from dedup import DedupWindow, DedupStore, RESTART_GAP, first_seqn
+import snapshot
+
+# A burst larger than the window followed by a late redundant copy of one of
+# its first ids: the late copy is a duplicate and the burst stays seen.
+
+WIDTH = 500
+BURST = 600
+LATE = 50
+
+
+def check_late_copy(seen) -> None:
+    start = first_seqn()
+    assert not any(seen(start + seqn) for seqn in range(BURST))
+    assert seen(start + LATE), "late copy behind the window delivered again"
+    redelivered = [seqn for seqn in range(BURST) if not seen(start + seqn)]
+    assert not redelivered, f"{len(redelivered)} ids of the burst delivered again"
+
+
+def check_restart(seen) -> None:
+    start = first_seqn()
+    for seqn in range(BURST):
+        seen(start + seqn)
+    # Earlier version numbering from 0 again after a restart
+    assert not seen(start - RESTART_GAP)
+    assert seen(start - RESTART_GAP)
+
+
+def test_late_copy_after_burst():
+    window = DedupWindow(WIDTH)
+    check_late_copy(lambda seqn: window.seen(1, seqn))
+    store = DedupStore(1 << 20, WIDTH)
+    check_late_copy(lambda seqn: store.seen("t", 1, seqn))
+
+
+def test_origin_restart():
+    window = DedupWindow(WIDTH)
+    check_restart(lambda seqn: window.seen(1, seqn))
+    store = DedupStore(1 << 20, WIDTH)
+    check_restart(lambda seqn: store.seen("t", 1, seqn))
+
+
+def test_restored_origin_numbers_ahead():
+    window = DedupWindow(WIDTH)
+    before = first_seqn()
+    for seqn in range(before, before + BURST):
+        window.seen(1, seqn)
+    # Snapshot written before the burst, the origin then restarts from it
+    record = snapshot.encode_state((None, 0, (), (), False, before), 1)
+    next_id = snapshot.decode_state(record)[5]
+    assert next_id >= before + BURST
+    assert not window.seen(1, next_id)
+
+
+if __name__ == '__main__':
+    test_late_copy_after_burst()
+    test_origin_restart()
+    test_restored_origin_numbers_ahead()
+    print("ok")
@@ -0,0 +1,39 @@
+import collections
+import os
+import random
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+from metrics import TopK
+
+# Busy topics among many quiet ones: the busy ones are tracked, no count is
+# underestimated, and the buckets stay consistent with the counts.
+
+
+def test_heavy_hitters():
+    rng = random.Random(0)
+    topics = [f"t/{i}" for i in range(5000)]
+    busy = topics[:10]
+    top = TopK(80)
+    true = collections.Counter()
+    for i in range(100000):
+        topic = rng.choice(busy) if rng.random() < 0.3 else rng.choice(topics)
+        top.add(topic)
+        true[topic] += 1
+        if i % 997 == 0:
+            assert len(top.counts) <= 80
+            assert top.min == min(top.counts.values())
+            assert sum(map(len, top.buckets.values())) == len(top.counts)
+
+    assert all(top.counts[topic] >= true[topic] for topic in top.counts)
+    assert {topic for topic, _ in top.top(10)} == set(busy)
+
+
+if __name__ == '__main__':
+    test_heavy_hitters()
+    print("ok")
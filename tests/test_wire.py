@@ -0,0 +1,73 @@
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+
+from message import decode_frame, set_wire_format, RoutedPub, CoreAnn, PubId, ROUTED_PUB, CORE_ANN, FLAG_TOPIC, WIRE_BINARY
+
+# Binary frames a decoder does not fully understand are rejected, never misread.
+
+
+def routed_pub(**fields) -> bytes:
+    set_wire_format(WIRE_BINARY)
+    return bytes(RoutedPub(pub_id=PubId(origin_id=1, seqn=7), sender_id=2, payload=b"data", **fields).serialize("a/#")[1])
+
+
+def rejects(frame: bytes) -> bool:
+    try:
+        decode_frame(ROUTED_PUB, frame)
+    except ValueError:
+        return True
+    return False
+
+
+def test_unknown_flags_rejected():
+    frame = bytearray(routed_pub())
+    for flag in (0x04, 0x80):
+        frame[2] = flag
+        assert rejects(bytes(frame)), f"frame with flag {flag:#04x} decoded"
+
+
+def test_known_flags_decoded():
+    msg = decode_frame(ROUTED_PUB, routed_pub(topic="a/b", trace=(5, ((2, 3),))))
+    assert (msg.topic, msg.trace, bytes(msg.payload)) == ("a/b", (5, ((2, 3),)), b"data")
+
+
+def decode_version_1(kind: int, frame: bytes):
+    """A federator that only knows version 1 frames."""
+    if frame[0] != 1:
+        raise ValueError(f"Unknown wire format version {frame[0]}")
+    return decode_frame(kind, frame)
+
+
+def test_mixed_versions():
+    # Frames without sections stay readable by version 1 federators
+    plain = routed_pub()
+    assert bytes(decode_version_1(ROUTED_PUB, plain).payload) == b"data"
+    core_ann = bytes(CoreAnn(core_id=1, dist=0, sender_id=1, seqn=3).serialize("a/#")[1])
+    assert decode_version_1(CORE_ANN, core_ann).seqn == 3
+
+    # Frames with the topic or a trace are refused by them, not misread
+    for fields in ({'topic': "a/b"}, {'trace': (5, ())}):
+        try:
+            decode_version_1(ROUTED_PUB, routed_pub(**fields))
+        except ValueError:
+            continue
+        raise AssertionError(f"version 1 decoder accepted a frame with {fields}")
+
+    # A version 1 frame with a section, as sent before the version existed
+    frame = bytearray(routed_pub(topic="a/b"))
+    frame[0] = 1
+    assert frame[2] == FLAG_TOPIC
+    assert rejects(bytes(frame))
+
+
+if __name__ == '__main__':
+    test_unknown_flags_rejected()
+    test_known_flags_decoded()
+    test_mixed_versions()
+    print("ok")
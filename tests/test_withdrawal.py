@@ -0,0 +1,61 @@
+import os
+import sys
+
+# Get the absolute path of the 'src' folder
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Add the 'src' folder to sys.path
+sys.path.append(src_path)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from simulate_convergence import Simulation
+from topologies import grid
+from message import set_wire_format, WIRE_BINARY, WIRE_PICKLE
+
+# A core withdrawing while its first CoreAnn is still flooding the nine-broker
+# grid of federation_scenario: the stale CoreAnns and the withdrawal must not
+# chase each other around the cycles, and no broker may keep the old core.
+
+# Far more than a flood and a withdrawal over 12 links take
+EVENT_LIMIT = 10000
+
+
+def withdraw_during_flood(wire_format: str, gap: float) -> Simulation:
+    set_wire_format(wire_format)
+    sim = Simulation(grid(9), redundancy=2, cache_size=64, latency=0.002, jitter=0.25, service=0.00005, seed=0)
+    sim.subscribe(0.0, 1, "y/#")
+    sim.unsubscribe(gap, 1, "y/#")
+    sim.run(EVENT_LIMIT)
+    return sim
+
+
+def check_settled(sim: Simulation) -> None:
+    assert not sim.events, f"still flooding after {sim.processed} events"
+    for broker, workers in sim.workers.items():
+        worker = workers.get("y/#")
+        if worker is not None:
+            assert worker.current_core is None, f"broker {broker} kept core {worker.current_core}"
+            assert not worker.children, f"broker {broker} kept children {worker.children}"
+
+
+def test_withdraw_during_initial_flood():
+    for wire_format in (WIRE_BINARY, WIRE_PICKLE):
+        # Right away, half way through and once the flood is over
+        for gap in (0.0, 0.003, 0.05):
+            check_settled(withdraw_during_flood(wire_format, gap))
+
+
+def test_resubscribe_after_withdrawal():
+    sim = withdraw_during_flood(WIRE_BINARY, 0.0)
+    sim.subscribe(sim.now + 0.001, 1, "y/#")
+    sim.subscribe(sim.now + 0.05, 9, "y/#")
+    sim.run(EVENT_LIMIT)
+    assert not sim.events
+    assert sim.mesh("y/#") and all(sim.workers[broker]["y/#"].current_core is not None for broker in sim.workers)
+    assert sim.workers[9]["y/#"].current_core.id == 1
+
+
+if __name__ == '__main__':
+    test_withdraw_during_initial_flood()
+    test_resubscribe_after_withdrawal()
+    print("ok")
@@ -0,0 +1,66 @@
+import math
+import random
+from typing import Dict, List
+
+# Synthetic federation topologies as adjacency lists: broker id -> neighbor ids.
+# Broker ids start at 1 like the federation_scenario configs.
+
+TOPOLOGIES = ("ring", "grid", "scale-free")
+
+
+def ring(n: int) -> Dict[int, List[int]]:
+    if n < 3:
+        return line(n)
+    return {id: [(id - 2) % n + 1, id % n + 1] for id in range(1, n + 1)}
+
+
+def line(n: int) -> Dict[int, List[int]]:
+    return {id: [other for other in (id - 1, id + 1) if 1 <= other <= n] for id in range(1, n + 1)}
+
+
+def grid(n: int) -> Dict[int, List[int]]:
+    """Brokers on a square-ish grid, each linked to its horizontal and vertical neighbors."""
+    width = math.ceil(math.sqrt(n))
+    adjacency = {id: [] for id in range(1, n + 1)}
+    for id in adjacency:
+        row, col = divmod(id - 1, width)
+        for other in (id + 1 if col + 1 < width else None, id + width):
+            if other is not None and other <= n:
+                adjacency[id].append(other)
+                adjacency[other].append(id)
+    return adjacency
+
+
+def scale_free(n: int, links: int = 2, seed: int = 0) -> Dict[int, List[int]]:
+    """Barabasi-Albert graph: each new broker links to `links` brokers picked by degree."""
+    rng = random.Random(seed)
+    links = max(1, links)
+    adjacency = {id: [] for id in range(1, n + 1)}
+    # Every broker appears once per link it has, picking from it favours hubs
+    ends = []
+    for id in range(1, n + 1):
+        if id <= links:
+            # The first brokers form a line
+            if id > 1:
+                adjacency[id].append(id - 1)
+                adjacency[id - 1].append(id)
+                ends.extend((id, id - 1))
+            continue
+        targets = set()
+        while len(targets) < links:
+            targets.add(rng.choice(ends) if ends else rng.randint(1, id - 1))
+        for other in targets:
+            adjacency[id].append(other)
+            adjacency[other].append(id)
+            ends.extend((id, other))
+    return adjacency
+
+
+def generate(kind: str, n: int, links: int = 2, seed: int = 0) -> Dict[int, List[int]]:
+    if kind == "ring":
+        return ring(n)
+    if kind == "grid":
+        return grid(n)
+    if kind == "scale-free":
+        return scale_free(n, links, seed)
+    raise ValueError(f"Unknown topology {kind}, expected one of {TOPOLOGIES}")